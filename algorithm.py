@@ -110,12 +110,16 @@ class TradingAlgorithm(object):
                  # pd
                  underneath_model=None,
                  broker=None,
+                 intraday_book=None,
                  # pipe API
                  pipelines=None,
                  final=None,
                  disallow_righted=True,
                  disallowed_violation=True,
                  engine=None,
+                 pipeline_chunksize=None,
+                 pipeline_memo=None,
+                 pipeline_workers=1,
                  # risk
                  risk_fuse=None,
                  risk_models=None,
@@ -141,6 +145,7 @@ class TradingAlgorithm(object):
         self.slippage = slippage_model or NoSlippage()
         self.commission = commission_model or NoCommission()
         self.execution_style = execution_style or MarketOrder()
+        self.intraday_book = intraday_book
         self.restrictions = restrictions or NoRestrictions()
         self.account_controls = account_controls or []
         self.trading_controls = trading_controls or [NoControl()]
@@ -148,6 +153,9 @@ class TradingAlgorithm(object):
         # set engine module
         self.violated = disallowed_violation
         self.righted = disallow_righted
+        self.pipeline_chunksize = pipeline_chunksize
+        self.pipeline_memo = pipeline_memo
+        self.pipeline_workers = pipeline_workers
         self.final = final or Final()
         self.pipelines = pipelines or []
         self.pipeline_engine = engine
@@ -210,7 +218,8 @@ class TradingAlgorithm(object):
                                   self.sim_params.per_capital)
         blotter = SimulationBlotter(self.commission,
                                     self.slippage,
-                                    self.execution_style)
+                                    self.execution_style,
+                                    book=self.intraday_book)
         # generator --- compute capital or position to transactions
         generator = Generator(self.sim_params.delay,
                               blotter,
@@ -230,7 +239,11 @@ class TradingAlgorithm(object):
                                                         self.final,
                                                         self.restrictions,
                                                         self.righted,
-                                                        self.violated)
+                                                        self.violated,
+                                                        chunksize=self.pipeline_chunksize,
+                                                        end_session=self.sim_params.sessions[-1],
+                                                        workers=self.pipeline_workers,
+                                                        memo=self.pipeline_memo)
 
             self.ledger = Ledger(self.sim_params, self.risk_models, self.risk_fuse)
             self._create_broker()
@@ -341,9 +354,10 @@ class TradingAlgorithm(object):
         # Create px_trade and loop through simulated_trading.
         # Each iteration returns a perf dictionary
         perfs = []
-        for perf in self.yield_simulation():
-            print('perf', perf)
-            perfs.append(perf)
+        with self.pipeline_engine:
+            for perf in self.yield_simulation():
+                print('perf', perf)
+                perfs.append(perf)
         # convert perf dict to pandas frame
         analysis = self._create_daily_stats(perfs)
         # analysis = self.analyse(daily_stats)
@@ -17,18 +17,36 @@ class CommissionModel(ABC):
     def calculate(self, order):
         raise NotImplementedError
 
+    def calculate_batch(self, orders):
+        """
+        :param orders: OrderBatch
+        :return: np.ndarray , cost of each order (calculate on the view of each row)
+        """
+        return np.array([self.calculate(order) for order in orders], dtype=np.float64)
+
 
 class NoCommission(CommissionModel):
 
     def calculate(self, order):
         return 0.0
 
+    def calculate_batch(self, orders):
+        return np.zeros(len(orders), dtype=np.float64)
+
+
+# 印花税 --- 卖出 1‰ ; 过户费 --- 上海 0.02‰ ; 佣金 --- 2015-06-09之后 万1 , 之前 千1 (乘以multiplier)
+StampRate = 1e-3
+TransferRate = 2 * 1e-5
+RateChangeDate = np.datetime64('2015-06-09')
+
 
 class Commission(CommissionModel):
     """
         1、印花税：1‰(卖的时候才收取，此为国家税收，全国统一)
         2、过户费：深圳交易所无此项费用，上海交易所收费标准(按成交金额的0.02‰人民币)
         3、交易佣金：最高收费为3‰，最低收费5元。各家劵商收费不一，开户前可咨询清楚。 2015年之后万/3
+
+        fees are computed on arrays (calculate_fees) , calculate is the one order case
     """
     def __init__(self, multiplier=5):
         self.multiplier = multiplier
@@ -43,36 +61,69 @@ class Commission(CommissionModel):
     def min_cost(self, val):
         self.base_cost = val
 
-    def _generate_fee_rate(self, order):
-        dt = order.created_dt
-        dt = dt if isinstance(dt, pd.Timestamp) else pd.Timestamp(dt)
-        base_rate = 1e-4 if dt > pd.Timestamp('2015-06-09') else 1e-3
-        commission_rate = base_rate * self.multiplier
-        return commission_rate
+    def fee_rates(self, is_sh, is_sell, dates):
+        """
+        :param is_sh: np.ndarray[bool] , 上海 (sid startswith '6')
+        :param is_sell: np.ndarray[bool] , amount is not positive
+        :param dates: np.ndarray[datetime64] , created_dt of orders
+        :return: np.ndarray , 完整的交易费率
+        """
+        base_rate = np.where(np.asarray(dates, dtype='datetime64[ns]') > RateChangeDate, 1e-4, 1e-3)
+        return np.where(is_sell, StampRate, 0) + np.where(is_sh, TransferRate, 0) + base_rate * self.multiplier
+
+    def calculate_fees(self, amounts, prices, is_sh, is_sell, dates):
+        """
+            cost = max(|amount| * price * fee_rate , min_cost) of each order
+
+        :param amounts: np.ndarray
+        :param prices: np.ndarray
+        :param is_sh: np.ndarray[bool]
+        :param is_sell: np.ndarray[bool]
+        :param dates: np.ndarray[datetime64]
+        :return: np.ndarray
+        """
+        # amount of sell order is negative , fee is charged on the absolute capital
+        capital = np.abs(np.asarray(amounts, dtype=np.float64)) * np.asarray(prices, dtype=np.float64)
+        return np.maximum(capital * self.fee_rates(is_sh, is_sell, dates), self.min_cost)
 
     def calculate_rate_fee(self, order):
-        asset = order.asset
-        # 印花税 1‰(卖的时候才收取，此为国家税收，全国统一)
-        stamp_cost = 0 if np.sign(order.amount) == 1 else 1e-3
-        # 过户费：深圳交易所无此项费用，上海交易所收费标准(按成交金额的0.02)
-        transfer_cost = 2 * 1e-5 if asset.sid.startswith('6') else 0
-        # 交易佣金：最高收费为3‰，最低收费5元。各家劵商收费不一，开户前可咨询清楚。 2015年之后万/3
-        commission_rate = self._generate_fee_rate(order)
-        # 完整的交易费率
-        fee = stamp_cost + transfer_cost + commission_rate
-        return fee
+        rate = self.fee_rates(order.asset.sid.startswith('6'),
+                              np.sign(order.amount) != 1,
+                              pd.Timestamp(order.created_dt).to_datetime64())
+        return float(rate)
+
+    def calculate_batch(self, orders):
+        """
+        :param orders: OrderBatch
+        :return: np.ndarray , cost of each order in one vectorized expression
+        """
+        return self.calculate_fees(orders.amount,
+                                   orders.price,
+                                   np.char.startswith(orders.sid, '6'),
+                                   np.sign(orders.amount) != 1,
+                                   orders.ticker)
 
     def calculate(self, order):
         """
         :param order: Order object
         :return: cost for order
         """
-        print('order', order)
-        capital = order.amount * order.price
-        cost = capital * self.calculate_rate_fee(order)
-        print('cost', cost)
-        cost = cost if cost >= self.min_cost else self.min_cost
-        return cost
+        cost = self.calculate_fees(order.amount,
+                                   order.price,
+                                   order.asset.sid.startswith('6'),
+                                   np.sign(order.amount) != 1,
+                                   pd.Timestamp(order.created_dt).to_datetime64())
+        return float(cost)
 
 
 __all__ = ['NoCommission', 'Commission']
+
+
+# if __name__ == '__main__':
+#
+#     commission = Commission()
+#     dates = np.array(['2020-09-01'], dtype='datetime64[ns]')
+#     buy = commission.calculate_fees([10000], [10.0], [True], [False], dates)
+#     sell = commission.calculate_fees([-10000], [10.0], [True], [True], dates)
+#     # 印花税 1‰ --- sell costs 100 more than the same buy
+#     assert np.allclose(sell - buy, 10000 * 10.0 * 1e-3), (buy, sell)
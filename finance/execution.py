@@ -6,7 +6,6 @@ Created on Tue Mar 12 15:37:47 2019
 @author: python
 """
 from abc import ABC, abstractmethod
-from functools import lru_cache
 from gateway.driver.data_portal import portal
 
 
@@ -21,11 +20,26 @@ class ExecutionStyle(ABC):
         that the stop has been reached.
     """
     @staticmethod
-    @lru_cache(maxsize=32)
+    def get_pre_closes(assets, dt):
+        """
+            pre_close of assets from the session price limit table of portal (primed at BEFORE_TRADING_START) ,
+            the missing ones are fetched by one portal read
+        """
+        return portal.get_price_limits(assets, dt)['pre_close']
+
+    @staticmethod
     def get_pre_close(asset, dt):
-        open_pct, pre_close = portal.get_open_pct(asset, dt)
+        pre_close = ExecutionStyle.get_pre_closes([asset], dt).iloc[0]
         return pre_close
 
+    @staticmethod
+    def get_price_limit(asset, dt):
+        """
+            (limit_up , limit_down) of asset on dt --- pre_close * (1 ± restricted_change)
+        """
+        limit_up, limit_down = portal.get_price_limits([asset], dt).iloc[0][['limit_up', 'limit_down']]
+        return limit_up, limit_down
+
     @abstractmethod
     def get_limit_ratio(self, asset, dts):
         """
@@ -50,13 +64,11 @@ class MarketOrder(ExecutionStyle):
     This is the default for orders placed with :func:`~zipline.api.order`.
     """
     def get_limit_ratio(self, asset, dts):
-        pre_close = super().get_pre_close(asset, dts)
-        limit_price = pre_close * (1 + asset.restricted_change(dts))
+        limit_price, _ = super().get_price_limit(asset, dts)
         return limit_price
 
     def get_stop_ratio(self, asset, dts):
-        pre_close = super().get_pre_close(asset, dts)
-        stop_price = pre_close * (1 - asset.restricted_change(dts))
+        _, stop_price = super().get_price_limit(asset, dts)
         return stop_price
 
 
@@ -80,8 +92,7 @@ class LimitOrder(ExecutionStyle):
         return limit_price
 
     def get_stop_ratio(self, asset, dts):
-        pre_close = super().get_pre_close(asset, dts)
-        stop_price = pre_close * (1 - asset.restricted_change(dts))
+        _, stop_price = super().get_price_limit(asset, dts)
         return stop_price
 
 
@@ -101,8 +112,7 @@ class StopOrder(ExecutionStyle):
         self.stop = stop
 
     def get_limit_ratio(self, asset, dts):
-        pre_close = super().get_pre_close(asset, dts)
-        limit_price = pre_close * (1 + asset.restricted_change(dts))
+        limit_price, _ = super().get_price_limit(asset, dts)
         return limit_price
 
     def get_stop_ratio(self, asset, dts):
@@ -10,6 +10,7 @@ from finance.portfolio import Portfolio
 from finance.account import Account
 # from finance._protocol import MutableView
 from finance.position_tracker import PositionTracker
+from finance.transaction import TransactionBatch
 from risk.alert import UnionRisk
 
 
@@ -78,7 +79,13 @@ class Ledger(object):
 
     def process_transaction(self, transactions):
         print('ledger process_transaction')
-        txn_capital = self.position_tracker.handle_transactions(transactions)
+        if isinstance(transactions, TransactionBatch):
+            # cash flow on the columns of batch , Transaction views are materialized once
+            txn_capital = transactions.capital
+            transactions = transactions.to_transactions()
+            self.position_tracker.handle_transactions(transactions)
+        else:
+            txn_capital = self.position_tracker.handle_transactions(transactions)
         print('txn_capital', txn_capital)
         self._cash_flow(txn_capital)
         self._processed_transaction.extend(transactions)
@@ -5,8 +5,8 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
-import uuid
-from enum import Enum
+import uuid, numpy as np, pandas as pd
+from enum import Enum, IntEnum
 
 
 class OrderType(Enum):
@@ -52,7 +52,8 @@ class Order(object):
         return self.asset.sid
 
     def __eq__(self, other):
-        if isinstance(other, PriceOrder) and self.__dict__ == other.__dict__:
+        # __slots__ class has no __dict__
+        if type(other) is type(self) and self.to_dict() == other.to_dict():
             return True
         return False
 
@@ -101,7 +102,8 @@ class PriceOrder(Order):
         return self.asset.sid
 
     def __eq__(self, other):
-        if isinstance(other, PriceOrder) and self.__dict__ == other.__dict__:
+        # __slots__ class has no __dict__
+        if type(other) is type(self) and self.to_dict() == other.to_dict():
             return True
         return False
 
@@ -150,7 +152,8 @@ class TickerOrder(Order):
         return self.asset.sid
 
     def __eq__(self, other):
-        if isinstance(other, TickerOrder) and self.__dict__ == other.__dict__:
+        # __slots__ class has no __dict__
+        if type(other) is type(self) and self.to_dict() == other.to_dict():
             return True
         return False
 
@@ -189,10 +192,143 @@ def transfer_to_order(order, ticker=None, price=None):
     return new_order
 
 
+class OrderKind(IntEnum):
+    """
+        kind column of OrderBatch
+    """
+    ORDER = 0
+    PRICE = 1
+    TICKER = 2
+
+
+OrderFields = np.dtype([('sid', 'U10'),
+                        ('price', np.float64),
+                        ('amount', np.int64),
+                        ('ticker', 'datetime64[ns]'),
+                        ('kind', np.int8)])
+
+
+class OrderBatch(object):
+    """
+        orders of a session as one structured array (sid , price , amount , ticker , kind) ,
+        a day of split orders costs a few numpy allocations instead of thousands of objects ;
+        Order / PriceOrder / TickerOrder are thin views created on iteration
+
+    Parameters
+    ----------
+    data : np.ndarray
+        structured array of OrderFields
+    assets : dict
+        sid : Asset of data
+    """
+    __slots__ = ['data', 'assets']
+
+    def __init__(self, data, assets):
+        self.data = data
+        self.assets = assets
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=OrderFields), dict())
+
+    @classmethod
+    def from_arrays(cls, asset, amounts, tickers=None, prices=None, kind=OrderKind.TICKER):
+        """
+            orders of one asset , e.g. split orders of Division
+        """
+        data = np.empty(len(amounts), dtype=OrderFields)
+        data['sid'] = asset.sid
+        data['amount'] = amounts
+        data['price'] = np.nan if prices is None else prices
+        data['ticker'] = np.datetime64('NaT') if tickers is None else pd.DatetimeIndex(tickers).values
+        data['kind'] = kind
+        return cls(data, {asset.sid: asset})
+
+    @classmethod
+    def from_orders(cls, orders):
+        data = np.empty(len(orders), dtype=OrderFields)
+        assets = dict()
+        for loc, order in enumerate(orders):
+            kind = OrderKind.TICKER if isinstance(order, TickerOrder) else \
+                OrderKind.PRICE if isinstance(order, PriceOrder) else OrderKind.ORDER
+            ticker = None if kind == OrderKind.PRICE else order.created_dt
+            price = None if kind == OrderKind.TICKER else order.price
+            data[loc] = (order.asset.sid,
+                         np.nan if price is None else price,
+                         order.amount,
+                         np.datetime64('NaT') if ticker is None else pd.Timestamp(ticker).to_datetime64(),
+                         kind)
+            assets[order.asset.sid] = order.asset
+        return cls(data, assets)
+
+    @classmethod
+    def concat(cls, batches):
+        batches = list(batches)
+        if not batches:
+            return cls.empty()
+        assets = dict()
+        for batch in batches:
+            assets.update(batch.assets)
+        return cls(np.concatenate([batch.data for batch in batches]), assets)
+
+    @property
+    def sid(self):
+        return self.data['sid']
+
+    @property
+    def price(self):
+        return self.data['price']
+
+    @property
+    def amount(self):
+        return self.data['amount']
+
+    @property
+    def ticker(self):
+        return self.data['ticker']
+
+    @property
+    def kind(self):
+        return self.data['kind']
+
+    def view(self, loc):
+        """
+            Order / PriceOrder / TickerOrder of row loc
+        """
+        row = self.data[loc]
+        asset = self.assets[row['sid']]
+        kind, amount, price = row['kind'], int(row['amount']), float(row['price'])
+        if kind == OrderKind.TICKER:
+            return TickerOrder(asset, amount, pd.Timestamp(row['ticker']))
+        if kind == OrderKind.PRICE:
+            return PriceOrder(asset, amount, price)
+        ticker = None if np.isnat(row['ticker']) else pd.Timestamp(row['ticker'])
+        return Order(asset=asset, price=price, amount=amount, ticker=ticker)
+
+    def to_orders(self):
+        return [self.view(loc) for loc in range(len(self.data))]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.view(key)
+        return type(self)(self.data[key], self.assets)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.to_orders())
+
+    def __repr__(self):
+        return "OrderBatch(size=%d, assets=%r)" % (len(self.data), sorted(self.assets))
+
+
 __all__ = ['Order',
            'PriceOrder',
            'TickerOrder',
-           'transfer_to_order']
+           'transfer_to_order',
+           'OrderKind',
+           'OrderBatch']
 
 
 # if __name__ == '__main__':
@@ -7,7 +7,6 @@ Created on Tue Mar 12 15:37:47 2019
 """
 from toolz import valmap
 from collections import defaultdict, OrderedDict
-from functools import partial
 from finance.position import Position
 from gateway.driver.data_portal import portal
 
@@ -93,16 +92,19 @@ class PositionTracker(object):
         if sync_date_set:
             assert len(sync_date_set) == 1, 'all positions must be sync on the same date'
             sync_date = sync_date_set[0]
-            get_price = partial(portal.get_spot_value,
-                                dts=sync_date,
-                                frequency='daily',
-                                field='close')
             closed_positions = self.record_closed_position[sync_date]
             print('synchronize closed_position', closed_positions)
             update_positions = set(closed_positions) | set(self.positions.values())
             print('synchronize update_positions', update_positions)
+            # one read of close for all positions
+            closes = portal.get_spot_values(sync_date,
+                                            [p.asset for p in update_positions],
+                                            'daily',
+                                            ['close'])['close']
             for p in update_positions:
-                p.inner_position.last_sync_price = get_price(asset=p.asset)
+                # suspended asset keeps the last sync price
+                if p.asset.sid in closes.index:
+                    p.inner_position.last_sync_price = closes[p.asset.sid]
                 # update position_returns
                 p.calculate_returns()
 
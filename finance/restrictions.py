@@ -7,12 +7,24 @@ Created on Tue Mar 12 15:37:47 2019
 """
 from abc import ABC, abstractmethod
 from functools import reduce
-import pandas as pd, operator
+import pandas as pd, numpy as np, operator
 from gateway.asset.assets import Asset
 from gateway.asset.finder import asset_finder
+from gateway.driver.data_portal import portal
 from _calendar.trading_calendar import calendar
 
 
+def _traded_bounds(assets):
+    # first_traded , last_traded of assets as datetime64 (NaT when missing)
+    first = pd.to_datetime([asset.first_traded or None for asset in assets], errors='coerce').values
+    last = pd.to_datetime([asset.last_traded or None for asset in assets], errors='coerce').values
+    return first, last
+
+
+def _session_values(sessions):
+    return pd.to_datetime(np.asarray(sessions)).values[:, None]
+
+
 class Restrictions(ABC):
     """
     Abstract restricted list interface, representing a set of asset that an
@@ -40,6 +52,29 @@ class Restrictions(ABC):
         """
         raise NotImplementedError('is_restricted')
 
+    def restricted_mask(self, assets, sessions):
+        """
+        Bulk form of ``is_restricted`` over sessions
+
+        Parameters
+        ----------
+        assets : list of Asset
+            fixed index of columns
+        sessions : list of str
+            sessions of rows
+
+        Returns
+        -------
+        mask : np.ndarray[bool]
+            (sessions × assets) , True means asset passes the restriction on session ;
+            default implementation evaluates ``is_restricted`` session by session
+        """
+        mask = np.zeros((len(sessions), len(assets)), dtype=bool)
+        for row, session in enumerate(sessions):
+            allowed = set(self.is_restricted(assets, session))
+            mask[row] = [asset in allowed for asset in assets]
+        return mask
+
     def __or__(self, other_restriction):
         """Base implementation for combining two restrictions.
         """
@@ -59,6 +94,9 @@ class NoRestrictions(Restrictions):
     def is_restricted(self, assets, dt):
         return set(assets)
 
+    def restricted_mask(self, assets, sessions):
+        return np.ones((len(sessions), len(assets)), dtype=bool)
+
 
 class StaticRestrictions(Restrictions):
     """
@@ -81,6 +119,10 @@ class StaticRestrictions(Restrictions):
         selector = set(assets) - set(self._restricted_set)
         return selector
 
+    def restricted_mask(self, assets, sessions):
+        allowed = np.array([asset not in self._restricted_set for asset in assets], dtype=bool)
+        return np.tile(allowed, (len(sessions), 1))
+
 
 class DataBoundsRestrictions(Restrictions):
     """
@@ -96,6 +138,14 @@ class DataBoundsRestrictions(Restrictions):
         final_assets = set(assets) & set(alive_assets)
         return final_assets
 
+    def restricted_mask(self, assets, sessions):
+        # first_traded <= window start and last_traded >= session (same as asset_finder.lifetimes)
+        first, last = _traded_bounds(assets)
+        starts = _session_values([calendar.dt_window_size(session, self.window) for session in sessions])
+        ends = _session_values(sessions)
+        mask = (np.isnat(first) | (first <= starts)) & (np.isnat(last) | (last >= ends))
+        return mask
+
 
 class StatusRestrictions(Restrictions):
     """
@@ -113,6 +163,26 @@ class StatusRestrictions(Restrictions):
         final_assets = (set(assets) - set(del_assets)) & set(trade_assets)
         return final_assets
 
+    def restricted_mask(self, assets, sessions):
+        """
+            active (first_traded <= session <= last_traded) with daily bar on session and
+            not in 退市整理期 (same as can_be_traded and delist_assets)
+        """
+        first, last = _traded_bounds(assets)
+        dts = _session_values(sessions)
+        active = (first <= dts) & (np.isnat(last) | (dts <= last))
+        # daily bar on session --- one slice of the columnar store over sessions
+        traded = portal.get_traded_mask(sessions, assets)
+        if self.length == 0:
+            delist = last == dts
+        else:
+            all_sessions = calendar.all_sessions
+            locs = np.searchsorted(all_sessions, np.asarray(sessions))[:, None]
+            last_locs = np.searchsorted(all_sessions, [asset.last_traded or '' for asset in assets])[None, :]
+            delist = (last > dts) & (last_locs - locs >= self.length)
+        mask = active & traded & ~delist
+        return mask
+
 
 class SwatRestrictions(Restrictions):
     """
@@ -175,11 +245,49 @@ class UnionRestrictions(Restrictions):
             (r.is_restricted(assets, dt) for r in self.sub_restrictions)
         )
 
+    def restricted_mask(self, assets, sessions):
+        return reduce(
+            operator.and_,
+            (r.restricted_mask(assets, sessions) for r in self.sub_restrictions)
+        )
+
+
+class RestrictionMasks(object):
+    """
+        per-session masks of restrictions over a fixed asset index , computed in bulk
+        once for a range of sessions ; daily universe is a row lookup
+
+    Parameters
+    ----------
+    restrictions : Restrictions
+    assets : iterable of Asset
+    sessions : list of str (sorted)
+    """
+    def __init__(self, restrictions, assets, sessions):
+        self.assets = np.empty(len(assets), dtype=object)
+        self.assets[:] = list(assets)
+        self.sessions = np.asarray(sessions).astype(str)
+        self.masks = restrictions.restricted_mask(list(self.assets), self.sessions)
+
+    def covers(self, dt):
+        loc = np.searchsorted(self.sessions, dt)
+        return loc < len(self.sessions) and self.sessions[loc] == dt
+
+    def lookup(self, dt, selector=None):
+        """
+            assets passing restrictions on dt , selector --- optional bool mask over assets
+        """
+        row = self.masks[np.searchsorted(self.sessions, dt)]
+        if selector is not None:
+            row = row & selector
+        return list(self.assets[row])
+
 
 __all__ = [
     'UnionRestrictions',
     'NoRestrictions',
     'StaticRestrictions',
     'DataBoundsRestrictions',
-    'StatusRestrictions'
+    'StatusRestrictions',
+    'RestrictionMasks'
 ]
@@ -5,7 +5,8 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
-from finance.order import Order
+import numpy as np, pandas as pd
+from finance.order import Order, OrderBatch
 
 
 class Transaction(object):
@@ -69,3 +70,89 @@ def create_transaction(order, commission):
         return transaction
     else:
         raise ValueError('Order object can transform to transaction')
+
+
+TransactionFields = np.dtype([('sid', 'U10'),
+                              ('amount', np.int64),
+                              ('price', np.float64),
+                              ('ticker', 'datetime64[ns]'),
+                              ('cost', np.float64)])
+
+
+class TransactionBatch(object):
+    """
+        transactions of a batch of orders as one structured array (sid , amount , price , ticker , cost) ;
+        Transaction is a thin view created on iteration , so ledger consumes it as a list
+
+    Parameters
+    ----------
+    data : np.ndarray
+        structured array of TransactionFields
+    assets : dict
+        sid : Asset of data
+    """
+    __slots__ = ['data', 'assets']
+
+    def __init__(self, data, assets):
+        self.data = data
+        self.assets = assets
+
+    @classmethod
+    def empty(cls):
+        return cls(np.empty(0, dtype=TransactionFields), dict())
+
+    @property
+    def capital(self):
+        """
+            cash flow of batch --- sum(amount * price + cost) , same as Position.update of each view
+        """
+        data = self.data
+        return float(np.sum(data['amount'] * data['price'] + data['cost']))
+
+    def view(self, loc):
+        row = self.data[loc]
+        return Transaction(asset=self.assets[row['sid']],
+                           amount=int(row['amount']),
+                           price=float(row['price']),
+                           dts=pd.Timestamp(row['ticker']),
+                           cost=float(row['cost']))
+
+    def to_transactions(self):
+        return [self.view(loc) for loc in range(len(self.data))]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self.view(key)
+        return type(self)(self.data[key], self.assets)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __iter__(self):
+        return iter(self.to_transactions())
+
+    def __repr__(self):
+        return "TransactionBatch(size=%d, assets=%r)" % (len(self.data), sorted(self.assets))
+
+
+def create_transactions(orders, commission):
+    """
+    :param orders: OrderBatch of trigger orders (price and ticker are filled)
+    :param commission: Commission object , cost of all orders by calculate_batch
+    :return: TransactionBatch
+    """
+    if not isinstance(orders, OrderBatch):
+        raise ValueError('OrderBatch can transform to transactions')
+    data = np.empty(len(orders), dtype=TransactionFields)
+    for field in ['sid', 'amount', 'price', 'ticker']:
+        data[field] = orders.data[field]
+    data['cost'] = commission.calculate_batch(orders)
+    return TransactionBatch(data, orders.assets)
+
+
+__all__ = [
+    'Transaction',
+    'TransactionBatch',
+    'create_transaction',
+    'create_transactions'
+]
@@ -60,6 +60,7 @@ class Asset(object):
     def tag(self):
         return self._tag
 
+    @property
     def bid_mechanism(self):
         """
             科创板 : 在临时停牌阶段，投资者可以继续申报也可以撤销申报，并且申报价格不受2%的报价限制。
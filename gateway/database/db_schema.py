@@ -378,6 +378,36 @@ equity_rights = sa.Table(
     extend_existing=True
 )
 
+# 前复权因子 --- ratio : 单次分红配股的复权比例 ; factor : 按ex_date累乘的ratio (ex_close缺失时ratio为空,factor不变)
+equity_adjustment_factor = sa.Table(
+    'equity_adjustment_factor',
+    metadata,
+    sa.Column(
+        'sid',
+        sa.String(10),
+        nullable=False,
+        primary_key=True
+    ),
+    sa.Column(
+        'ex_date',
+        sa.String(10),
+        nullable=False,
+        primary_key=True
+    ),
+    # dividends | rights
+    sa.Column(
+        'kind',
+        sa.String(10),
+        nullable=False,
+        primary_key=True
+    ),
+    sa.Column('pay_date', sa.String(10)),
+    sa.Column('ex_close', sa.Numeric(10, 5)),
+    sa.Column('ratio', sa.Numeric(20, 10)),
+    sa.Column('factor', sa.Numeric(20, 10), nullable=False),
+    extend_existing=True
+)
+
 # 股权结构 --- 由于数据问题存在declared_date ex_date 一致的情况（000012， 000002，600109）增加约束条件流通股和限制股
 ownership = sa.Table(
     # ['变动日期', '公告日期', '股本结构图', '变动原因', '总股本', '流通股', '流通A股', '高管股', '限售A股',
@@ -629,6 +659,7 @@ __all__ = [
            'equity_price',
            'equity_splits',
            'equity_rights',
+           'equity_adjustment_factor',
            'convertible_basics',
            'convertible_price',
            'asset_db_table_names'
@@ -14,6 +14,13 @@ BcolzDir = r'/Users/python/Downloads/bcolz'
 # bcolz sacle factor
 OHLC_RATIO = 100
 
+# bcolz ctable pool --- max opened ctables and max compressed bytes
+PoolOpenFiles = 256
+PoolMemoryBytes = 2 * 1024 ** 3
+
+# minute store --- 'bcolz' (one ctable per sid) or 'consolidated' (one ctable with sid offset index)
+MinuteStore = 'bcolz'
+
 # h5 -- scale factor
 # Retain 3 decimal places for prices.
 # Volume is expected to be a whole integer.
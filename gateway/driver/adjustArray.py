@@ -5,9 +5,10 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
+import numpy as np
 import pandas as pd
 from toolz import valmap
-from functools import partial
+from gateway.driver.adjustment_engine import AdjustmentEngine
 
 AdjustFields = frozenset(['open', 'high', 'low', 'close', 'volume'])
 
@@ -27,6 +28,10 @@ class HistoryCompatibleAdjustments(object):
     def reader(self):
         return self._reader
 
+    @property
+    def adjustments_reader(self):
+        return self._adjustments_reader
+
     @property
     def data_frequency(self):
         return self._reader.data_frequency
@@ -53,78 +58,108 @@ class HistoryCompatibleAdjustments(object):
             adjustments['rights'] = valmap(lambda x: reformat(x), adjustments['rights'])
         return adjustments
 
-    @staticmethod
-    def _calculate_dividends_for_sid(adjustment, data, sid):
+    def _frequency_adjust_factors(self, factors):
+        if self.data_frequency == 'minute':
+            # minutes --- 14:59
+            factors = factors.copy()
+            factors['ex_date'] = pd.to_datetime(factors['ex_date']) + pd.Timedelta(hours=14, minutes=59)
+        return factors
+
+    def calculate_adjustments_in_sessions(self, sessions, assets, data=None):
         """
            股权登记日后的下一个交易日就是除权日或除息日，这一天购入该公司股票的股东不再享有公司此次分红配股
            前复权：复权后价格=(复权前价格-现金红利)/(1+流通股份变动比例)
-           后复权：复权后价格=复权前价格×(1+流通股份变动比例)+现金红利
-        """
-        kline = data[sid]
-        try:
-            dividends = adjustment['dividends'][sid]
-            # print('dividends union', set(dividends.index) & set(kline.index))
-            ex_close = kline['close'].reindex(index=dividends.index)
-            qfq = (1 - dividends['bonus']/(10 * ex_close)) / \
-                  (1 + (dividends['sid_bonus'] + dividends['sid_transfer']) / 10)
-        except KeyError:
-            qfq = pd.Series(dtype=float)
-        return qfq
-
-    @staticmethod
-    def _calculate_rights_for_sid(adjustment, data, sid):
-        """
            配股除权价=（除权登记日收盘价+配股价*每股配股比例）/（1+每股配股比例）
+
+        Parameters
+        ----------
+        sessions : list , eg['2020-01-30', '2020-08-30']
+        assets : list of Asset
+        data : dict , optional
+            sid : unadjusted frame of sessions (already loaded) , read from reader by default
+
+        Returns
+        -------
+        adjs : pd.DataFrame
+            (sessions × sids) 前复权 coef of all assets
+        data : dict
+            sid : unadjusted frame
         """
-        kline = data[sid]
-        try:
-            rights = adjustment['rights'][sid]
-            # print('rights', sid, rights)
-            ex_close = kline['close'].reindex(index=rights.index)
-            # print('ex_close', ex_close)
-            qfq = (ex_close + (rights['rights_price'] * rights['rights_bonus']) / 10) / \
-                  (1 + rights['rights_bonus']/10)
-        except KeyError:
-            qfq = pd.Series(dtype=float)
-        return qfq
-
-    def calculate_coef_for_sid(self, adjustment, data, sid):
-        fq_dividends = self._calculate_dividends_for_sid(adjustment, data, sid)
-        fq_rights = self._calculate_rights_for_sid(adjustment, data, sid)
-        # print('rights', fq_rights)
-        fq = fq_dividends.append(fq_rights)
-        fq.sort_index(ascending=False, inplace=True)
-        qfq = 1 / fq.cumprod()
-        # print('qfq', qfq)
-        return qfq
-
-    def calculate_adjustments_in_sessions(self, sessions, assets):
+        # 获取对应的数据
+        if data is None:
+            data = self.reader.load_raw_arrays(sessions, assets, ['open', 'high', 'low', 'close', 'volume', 'amount'])
+        engine = AdjustmentEngine.from_frames(data)
+        # 前复权系数 --- lookup materialized factor (AdjustmentFactorWriter)
+        factors = self._adjustments_reader.load_adjustment_factors(sessions)
+        if len(factors):
+            adapted_factors = self._frequency_adjust_factors(factors)
+            qfq = engine.cumulative_factors(adapted_factors)
+        else:
+            # factor table is not materialized , calculate from 分红除权配股 and close on ex_date
+            adjustments = self._adjustments_reader.load_pricing_adjustments(sessions)
+            adapted_adjustments = self._frequency_adjust(adjustments)
+            events = engine.event_table(adapted_adjustments, engine.to_block(data, 'close'))
+            qfq = engine.factors(events)
+        adjs = pd.DataFrame(qfq, index=engine.sessions, columns=engine.sids)
+        return adjs, data
+
+    def calculate_adjustments_in_chunk(self, windows, assets, data=None):
         """
+            前复权 coef of a chunk of windows over one (sessions × sids) block , kline and adjustments
+            of the chunk are loaded once ; coef of a window only depends on the events visible at its
+            end , so the block coef is recomputed only when that set changes and the rows of each
+            window are the same as calculate_adjustments_in_sessions([start, end])
+
+        Parameters
+        ----------
+        windows : list of (start, end) , sorted by end
+        assets : list of Asset
+        data : dict , optional
+            sid : unadjusted frame of [first start, last end]
+
         Returns
         -------
-        adjustments : list[dict[int -> Adjustment]]
-            A list, where each element corresponds to the `columns`, of
-            mappings from index to adjustment objects to apply at that index.
-        sessions : list , eg['2020-01-30', '2020-08-30']
-
-        assets:
+        engine : AdjustmentEngine of the block
+        data : dict
+            sid : unadjusted frame
+        coefs : generator of ((start, end) , (sessions × sids) coef of block)
         """
-        adjs = {}
-        # 获取全部的分红除权配股数据
-        adjustments = self._adjustments_reader.load_pricing_adjustments(sessions)
-        # 基于data_frequency --- 调整adjustments
-        adapted_adjustments = self._frequency_adjust(adjustments)
-        # 获取对应的收盘价数据
-        data = self.reader.load_raw_arrays(sessions, assets, ['open', 'high', 'low', 'close', 'volume', 'amount'])
-        # 计算前复权系数
-        _calculate = partial(self.calculate_coef_for_sid, adjustment=adapted_adjustments, data=data)
-        for asset_obj in assets:
-            sid = asset_obj.sid
-            try:
-                adjs[sid] = _calculate(sid=sid)
-            except KeyError:
-                print('code: %s has not kline between session' % sid)
-        return adjs, data
+        sessions = [windows[0][0], windows[-1][1]]
+        if data is None:
+            data = self.reader.load_raw_arrays(sessions, assets, ['open', 'high', 'low', 'close', 'volume', 'amount'])
+        engine = AdjustmentEngine.from_frames(data)
+        factors = self._adjustments_reader.load_adjustment_factors(sessions)
+        if len(factors):
+            table = self._frequency_adjust_factors(factors)
+            pay_date = table['pay_date'].values
+
+            def visible(start, end):
+                return pay_date <= end
+
+            def calculate(mask):
+                return engine.cumulative_factors(table[mask])
+        else:
+            adjustments = self._adjustments_reader.load_pricing_adjustments(sessions)
+            events = engine.event_table(self._frequency_adjust(adjustments), engine.to_block(data, 'close'))
+            pay_date = events['pay_date'].values
+            rows = engine.sessions.get_indexer(events['ex_date'])
+
+            def visible(start, end):
+                # paid inside window and ex_date lands on the sessions of window
+                return (pay_date >= start) & (pay_date <= end) & (rows >= 0) & \
+                       (rows < (engine.sessions <= end).sum())
+
+            def calculate(mask):
+                return engine.factors(events[mask])
+
+        def coefs():
+            key, qfq = None, None
+            for window in windows:
+                mask = visible(*window)
+                if key is None or not np.array_equal(mask, key):
+                    key, qfq = mask, calculate(mask)
+                yield window, qfq
+        return engine, data, coefs()
 
 
 class SlidingWindow(object):
@@ -137,10 +172,18 @@ class SlidingWindow(object):
     def reader(self):
         return self._compatible_adjustment.reader
 
+    def load_pricing_adjustments(self, sessions):
+        adjustments = self._compatible_adjustment.adjustments_reader.load_pricing_adjustments(sessions)
+        return adjustments
+
     def get_spot_value(self, dt, asset, fields):
         spot_value = self.reader.get_spot_value(dt, asset, fields)
         return spot_value
 
+    def get_spot_values(self, dt, assets, fields):
+        spot_values = self.reader.get_spot_values(dt, assets, fields)
+        return spot_values
+
     def get_stack_value(self, tbl, sessions):
         stack = self.reader.get_stack_value(tbl, sessions)
         return stack
@@ -159,38 +202,56 @@ class SlidingWindow(object):
         )
         return _array
 
-    def window_arrays(self, sessions, assets, field):
+    def window_arrays(self, sessions, assets, field, data=None):
         """
         :param sessions: [a,b]
         :param assets: Assets list
         :param field: str or list
+        :param data: dict sid : unadjusted frame of sessions , optional
         :return: arrays which is adjusted by divdends and rights
         """
-        adjustments, frame_mappings = self._compatible_adjustment.calculate_adjustments_in_sessions(sessions, assets)
+        adjustments, frame_mappings = self._compatible_adjustment.calculate_adjustments_in_sessions(
+            sessions, assets, data)
         adjusted_fields = list(set(field) & AdjustFields)
         if adjusted_fields:
-            # 计算调整数据
+            # 计算调整数据 --- broadcast multiply over (sessions × sids) block
+            engine = AdjustmentEngine(adjustments.index, adjustments.columns)
+            qfq = adjustments.values
+            blocks = {col: engine.adjust(engine.to_block(frame_mappings, col), qfq) for col in adjusted_fields}
+            engine.to_frames(frame_mappings, blocks)
             adjust_arrays = {}
             for asset in assets:
                 sid = asset.sid
-                try:
-                    frame = frame_mappings[sid]
-                    qfq = adjustments[sid]
-                    qfq = qfq.reindex(index=set(frame.index))
-                    qfq.sort_index(inplace=True)
-                    qfq.fillna(method='bfill', inplace=True)
-                    qfq.fillna(1.0, inplace=True)
-                    # print('final qfq coef', qfq)
-                    frame[adjusted_fields] = frame.loc[:, adjusted_fields].multiply(qfq, axis=0)
-                    # adjust_arrays[sid] = frame[adjusted_fields]
-                    adjust_arrays[sid] = frame
-                except KeyError:
-                    adjust_arrays[sid] = pd.DataFrame()
+                adjust_arrays[sid] = frame_mappings.get(sid, pd.DataFrame())
         else:
             adjust_arrays = frame_mappings
 
         return adjust_arrays
 
+    def window_chunk(self, windows, assets, field, data=None):
+        """
+        :param windows: [(start, end), ...] sorted by end
+        :param assets: Assets list
+        :param field: list
+        :param data: dict sid : unadjusted frame of [first start, last end] , optional
+        :return: generator of ((start, end) , arrays which is adjusted by divdends and rights) ,
+                 the block of chunk is adjusted once per set of visible events and each window
+                 is sliced from it (same as window_arrays)
+        """
+        engine, frame_mappings, coefs = self._compatible_adjustment.calculate_adjustments_in_chunk(
+            windows, assets, data)
+        adjusted_fields = list(set(field) & AdjustFields)
+        raw_blocks = {col: engine.to_block(frame_mappings, col) for col in adjusted_fields}
+        cached, blocks = None, None
+        for (start, end), qfq in coefs:
+            if qfq is not cached:
+                cached, blocks = qfq, {col: engine.adjust(block, qfq) for col, block in raw_blocks.items()}
+            frames = {sid: frame.loc[start:end].copy() if len(frame) else frame
+                      for sid, frame in frame_mappings.items()}
+            engine.to_frames(frames, blocks)
+            adjust_arrays = {asset.sid: frames.get(asset.sid, pd.DataFrame()) for asset in assets}
+            yield (start, end), adjust_arrays
+
 
 class AdjustedDailyWindow(SlidingWindow):
     """
@@ -0,0 +1,214 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Mar 12 15:37:47 2019
+
+@author: python
+"""
+import numpy as np, pandas as pd, sqlalchemy as sa
+
+AdjustmentEventFields = ['sid', 'ex_date', 'pay_date', 'ratio']
+
+# numeric precision of adjustment columns in sql , shared by SQLiteAdjustmentReader (on the fly)
+# and AdjustmentFactorWriter (materialized factor) so both paths read the same values
+AdjustmentPrecision = {
+    'sid_bonus': (5, 2),
+    'sid_transfer': (5, 2),
+    'bonus': (15, 10),
+    'rights_bonus': (5, 2),
+    'rights_price': (10, 5)
+}
+
+
+def cast_adjustment(column):
+    """
+        sql cast of adjustment column by AdjustmentPrecision
+    """
+    return sa.cast(column, sa.Numeric(*AdjustmentPrecision[column.name]))
+
+
+def _stack_adjustments(mappings, columns):
+    """
+        sid : frame indexed by ex_date --- stacked frame with sid , ex_date columns
+    """
+    mappings = {sid: frame for sid, frame in mappings.items() if len(frame)}
+    if not mappings:
+        return pd.DataFrame(columns=['sid', 'ex_date'] + columns)
+    stack = pd.concat(mappings, names=['sid', 'ex_date'])
+    stack = stack.reset_index()
+    return stack
+
+
+def dividends_ratio(dividends, ex_close):
+    """
+        (1 - bonus / (10 * ex_close)) / (1 + (sid_bonus + sid_transfer) / 10)
+    """
+    bonus = np.asarray(dividends['bonus'], dtype=np.float64)
+    shares = np.asarray(dividends['sid_bonus'], dtype=np.float64) + \
+        np.asarray(dividends['sid_transfer'], dtype=np.float64)
+    ratio = (1 - bonus / (10 * ex_close)) / (1 + shares / 10)
+    return ratio
+
+
+def rights_ratio(rights, ex_close):
+    """
+        (ex_close + rights_price * rights_bonus / 10) / (1 + rights_bonus / 10)
+    """
+    rights_bonus = np.asarray(rights['rights_bonus'], dtype=np.float64)
+    rights_price = np.asarray(rights['rights_price'], dtype=np.float64)
+    ratio = (ex_close + (rights_price * rights_bonus) / 10) / (1 + rights_bonus / 10)
+    return ratio
+
+
+class AdjustmentEngine(object):
+    """
+        array based 前复权 engine
+
+        all windows share one (sessions × sids) layout , the row of block is session
+        (trade_dt or minute) and the column is sid ; adjustments of all sids are turned
+        into a (sid, ex_date, ratio) event table and the cumulative coef is computed
+        by a reversed cumprod along sessions ---
+
+        qfq[t, sid] = 1 / prod(ratio of events whose ex_date >= t)
+
+    Parameters
+    ----------
+    sessions : array-like
+        sorted unique labels of rows
+    sids : array-like
+        labels of columns
+    """
+    def __init__(self, sessions, sids):
+        self.sessions = pd.Index(sessions)
+        self.sids = pd.Index(sids)
+
+    @property
+    def shape(self):
+        return len(self.sessions), len(self.sids)
+
+    @classmethod
+    def from_frames(cls, frames):
+        """
+            layout covering sid : frame mappings (same as reader.load_raw_arrays)
+        """
+        if frames:
+            sessions = np.unique(np.concatenate([frame.index.values for frame in frames.values()]))
+        else:
+            sessions = []
+        return cls(sessions, list(frames))
+
+    def to_block(self, frames, field):
+        block = np.full(self.shape, np.nan)
+        for sid, frame in frames.items():
+            rows = self.sessions.get_indexer(frame.index)
+            block[rows, self.sids.get_loc(sid)] = frame[field].values
+        return block
+
+    def to_frames(self, frames, blocks):
+        """
+            write blocks back into sid : frame mappings (in place)
+        """
+        for sid, frame in frames.items():
+            rows = self.sessions.get_indexer(frame.index)
+            col = self.sids.get_loc(sid)
+            for field, block in blocks.items():
+                frame[field] = block[rows, col]
+        return frames
+
+    def _lookup(self, block, sids, dates):
+        rows = self.sessions.get_indexer(dates)
+        cols = self.sids.get_indexer(sids)
+        valid = (rows >= 0) & (cols >= 0)
+        out = np.full(len(rows), np.nan)
+        out[valid] = block[rows[valid], cols[valid]]
+        return out
+
+    def event_table(self, adjustments, close):
+        """
+        Parameters
+        ----------
+        adjustments : dict
+            'dividends' / 'rights' : sid : frame indexed by ex_date (SQLiteAdjustmentReader)
+        close : np.ndarray
+            (sessions × sids) unadjusted close , ex_close is looked up on ex_date
+
+        Returns
+        -------
+        events : pd.DataFrame
+            columns --- sid , ex_date , pay_date , ratio (dividends_ratio / rights_ratio)
+        """
+        dividends = _stack_adjustments(adjustments['dividends'], ['pay_date', 'sid_bonus', 'sid_transfer', 'bonus'])
+        ex_close = self._lookup(close, dividends['sid'], dividends['ex_date'])
+        dividends['ratio'] = dividends_ratio(dividends, ex_close)
+
+        rights = _stack_adjustments(adjustments['rights'], ['pay_date', 'rights_bonus', 'rights_price'])
+        ex_close = self._lookup(close, rights['sid'], rights['ex_date'])
+        rights['ratio'] = rights_ratio(rights, ex_close)
+
+        events = pd.concat([dividends[AdjustmentEventFields], rights[AdjustmentEventFields]], ignore_index=True)
+        return events
+
+    def factors(self, events):
+        """
+            (sessions × sids) 前复权 coef , 1.0 after the last ex_date ;
+            event which ex_date has no kline (ex_close is nan) is skipped
+        """
+        rows = self.sessions.get_indexer(events['ex_date'])
+        cols = self.sids.get_indexer(events['sid'])
+        ratio = events['ratio'].values.astype(np.float64)
+        valid = (rows >= 0) & (cols >= 0) & np.isfinite(ratio)
+        fq = np.ones(self.shape)
+        np.multiply.at(fq, (rows[valid], cols[valid]), ratio[valid])
+        qfq = 1 / np.cumprod(fq[::-1], axis=0)[::-1]
+        return qfq
+
+    def cumulative_factors(self, table):
+        """
+            (sessions × sids) 前复权 coef from the materialized factor table
+
+        Parameters
+        ----------
+        table : pd.DataFrame
+            columns --- sid , ex_date , factor (cumprod of ratio by ex_date of each sid) ,
+            sorted by sid and ex_date and restricted to events paid before the end of window
+
+        Returns
+        -------
+        qfq : np.ndarray
+            qfq[t, sid] = factor(last event before t) / factor(last event) , which is the same as
+            1 / prod(ratio of events whose ex_date >= t)
+        """
+        table = table[table['sid'].isin(self.sids)]
+        qfq = np.ones(self.shape)
+        if not len(table) or not len(self.sessions):
+            return qfq
+        cols = self.sids.get_indexer(table['sid'])
+        # event is before row t when ex_date < sessions[t]
+        rows = self.sessions.searchsorted(table['ex_date'], side='right')
+        factor = table['factor'].values.astype(np.float64)
+        prev = np.full(self.shape, np.nan)
+        inside = pd.DataFrame({'row': rows, 'col': cols, 'factor': factor})
+        inside = inside[inside['row'] < len(self.sessions)].drop_duplicates(['row', 'col'], keep='last')
+        prev[inside['row'].values, inside['col'].values] = inside['factor'].values
+        # forward fill along sessions
+        loc = np.where(np.isnan(prev), 0, np.arange(len(self.sessions))[:, None])
+        loc = np.maximum.accumulate(loc, axis=0)
+        prev = prev[loc, np.arange(len(self.sids))]
+        prev[np.isnan(prev)] = 1.0
+        last = pd.Series(factor).groupby(cols).last()
+        qfq[:, last.index.values] = prev[:, last.index.values] / last.values
+        return qfq
+
+    @staticmethod
+    def adjust(block, qfq):
+        return block * qfq
+
+
+__all__ = [
+    'rights_ratio',
+    'dividends_ratio',
+    'AdjustmentEngine',
+    'AdjustmentEventFields',
+    'AdjustmentPrecision',
+    'cast_adjustment'
+]
@@ -5,12 +5,14 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
+import hashlib
 import numpy as np
 import pandas as pd
 import sqlalchemy as sa
 from sqlalchemy import and_
 from gateway.database import engine, metadata
 from gateway.driver.tools import unpack_df_to_component_dict
+from gateway.driver.adjustment_engine import cast_adjustment
 
 
 ADJUSTMENT_COLUMNS_TYPE = {
@@ -27,13 +29,16 @@ class SQLiteAdjustmentReader(object):
         1 获取所有的分红 配股 数据用于pipeloader
         2.形成特定的格式的dataframe
     """
-    adjustment_tables = frozenset(['equity_splits', 'equity_rights'])
+    adjustment_tables = frozenset(['equity_splits', 'equity_rights', 'equity_adjustment_factor'])
 
     def __init__(self):
         self.engine = engine
         metadata.reflect(bind=engine)
         for tbl in self.adjustment_tables:
             setattr(self, tbl, metadata.tables[tbl])
+        self._factors = None
+        self._signature = None
+        self._version = None
 
     def __enter__(self):
         return self
@@ -53,12 +58,13 @@ class SQLiteAdjustmentReader(object):
         sdate, edate = sessions
         sql_dialect = sa.select([self.equity_splits.c.sid,
                                 self.equity_splits.c.ex_date,
-                                sa.cast(self.equity_splits.c.sid_bonus, sa.Numeric(5, 2)),
-                                sa.cast(self.equity_splits.c.sid_transfer, sa.Numeric(5, 2)),
-                                sa.cast(self.equity_splits.c.bonus, sa.Numeric(5, 2))]).\
+                                self.equity_splits.c.pay_date,
+                                cast_adjustment(self.equity_splits.c.sid_bonus),
+                                cast_adjustment(self.equity_splits.c.sid_transfer),
+                                cast_adjustment(self.equity_splits.c.bonus)]).\
             where(and_(self.equity_splits.c.pay_date.between(sdate, edate), self.equity_splits.c.progress.like('实施')))
         rp = self.engine.execute(sql_dialect)
-        divdends = pd.DataFrame(rp.fetchall(), columns=['sid', 'ex_date', 'sid_bonus',
+        divdends = pd.DataFrame(rp.fetchall(), columns=['sid', 'ex_date', 'pay_date', 'sid_bonus',
                                                         'sid_transfer', 'bonus'])
         divdends.set_index('sid', inplace=True)
         adjust_divdends = self._adjust_frame_type(divdends)
@@ -69,11 +75,12 @@ class SQLiteAdjustmentReader(object):
         sdate, edate = sessions
         sql = sa.select([self.equity_rights.c.sid,
                          self.equity_rights.c.ex_date,
-                         sa.cast(self.equity_rights.c.rights_bonus, sa.Numeric(5, 2)),
-                         sa.cast(self.equity_rights.c.rights_price, sa.Numeric(5, 2))]).\
+                         self.equity_rights.c.pay_date,
+                         cast_adjustment(self.equity_rights.c.rights_bonus),
+                         cast_adjustment(self.equity_rights.c.rights_price)]).\
             where(self.equity_rights.c.pay_date.between(sdate, edate))
         rp = self.engine.execute(sql)
-        rights = pd.DataFrame(rp.fetchall(), columns=['sid', 'ex_date',
+        rights = pd.DataFrame(rp.fetchall(), columns=['sid', 'ex_date', 'pay_date',
                                                       'rights_bonus', 'rights_price'])
         rights.set_index('sid', inplace=True)
         adjust_rights = self._adjust_frame_type(rights)
@@ -90,6 +97,59 @@ class SQLiteAdjustmentReader(object):
         pricing_adjustments = self._load_adjustments_from_sqlite(sessions)
         return pricing_adjustments
 
+    def _load_factors_from_sqlite(self):
+        sql = sa.select([self.equity_adjustment_factor.c.sid,
+                         self.equity_adjustment_factor.c.ex_date,
+                         self.equity_adjustment_factor.c.pay_date,
+                         sa.cast(self.equity_adjustment_factor.c.factor, sa.Numeric(20, 10))]).\
+            order_by(self.equity_adjustment_factor.c.sid,
+                     self.equity_adjustment_factor.c.ex_date,
+                     self.equity_adjustment_factor.c.kind)
+        rp = self.engine.execute(sql)
+        factors = pd.DataFrame(rp.fetchall(), columns=['sid', 'ex_date', 'pay_date', 'factor'])
+        factors['factor'] = factors['factor'].astype(np.float64)
+        return factors
+
+    def load_adjustment_factors(self, sessions):
+        """
+            前复权 factor materialized by AdjustmentFactorWriter , the table is small and
+            loaded once ; events paid after the end of sessions are excluded
+
+        Returns
+        -------
+        factors : pd.DataFrame
+            columns --- sid , ex_date , pay_date , factor (sorted by sid and ex_date)
+        """
+        if self._factors is None:
+            self._signature = self._factors_signature()
+            self._factors = self._load_factors_from_sqlite()
+        edate = sessions[-1]
+        factors = self._factors[self._factors['pay_date'] <= edate]
+        return factors
+
+    def _factors_signature(self):
+        # aggregate of factor table computed by sql , cheap check of a rewrite
+        table = self.equity_adjustment_factor
+        sql = sa.select([sa.func.count(), sa.func.max(table.c.pay_date),
+                         sa.func.sum(sa.cast(table.c.factor, sa.Numeric(20, 10)))])
+        return tuple(self.engine.execute(sql).fetchone())
+
+    @property
+    def version(self):
+        """
+            digest of the materialized factor table , changes when adjustments are rewritten ;
+            the table is reloaded when its signature changes (AdjustmentFactorWriter during a run)
+        """
+        signature = self._factors_signature()
+        if self._factors is None or signature != self._signature:
+            self._factors = self._load_factors_from_sqlite()
+            self._signature = signature
+            self._version = None
+        if self._version is None:
+            digest = pd.util.hash_pandas_object(self._factors, index=False).values
+            self._version = hashlib.md5(digest.tobytes()).hexdigest()
+        return self._version
+
     def retrieve_pay_date_dividends(self, assets, date):
         sql_dialect = sa.select([self.equity_splits.c.sid,
                                  sa.cast(self.equity_splits.c.sid_bonus, sa.Numeric(5, 2)),
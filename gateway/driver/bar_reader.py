@@ -68,6 +68,23 @@ class BarReader(ABC):
         """
         raise NotImplementedError()
 
+    def get_spot_values(self, dt, assets, fields):
+        """
+        Retrieve the values of assets at the given dt
+
+        Returns
+        -------
+        values : pd.DataFrame
+            (assets × fields) indexed by sid , asset without data on dt is dropped
+        """
+        spot = dict()
+        for asset in assets:
+            value = self.get_spot_value(dt, asset, fields)
+            if len(value):
+                spot[asset.sid] = value
+        values = pd.DataFrame.from_dict(spot, orient='index', columns=fields)
+        return values
+
     @abstractmethod
     def load_raw_arrays(self, sessions, assets, columns):
         """
@@ -159,6 +176,35 @@ class AssetSessionReader(BarReader):
             return frame.loc[0, fields]
         return kline
 
+    def get_spot_values(self, dt, assets, fields):
+        """
+            retrieve data of assets on dt --- one query per asset type
+        """
+        spots = []
+        for table, grp in groupby(lambda x: x.asset_type if x.asset_type in ['equity', 'convertible']
+                                  else 'fund', assets).items():
+            tbl = self.metadata.tables['%s_price' % table]
+            columns = ['sid', 'open', 'close', 'high', 'low', 'volume', 'amount']
+            selection = [tbl.c.sid,
+                         sa.cast(tbl.c.open, sa.Numeric(10, 2)).label('open'),
+                         sa.cast(tbl.c.close, sa.Numeric(12, 2)).label('close'),
+                         sa.cast(tbl.c.high, sa.Numeric(10, 2)).label('high'),
+                         sa.cast(tbl.c.low, sa.Numeric(10, 3)).label('low'),
+                         sa.cast(tbl.c.volume, sa.Numeric(15, 0)).label('volume'),
+                         sa.cast(tbl.c.amount, sa.Numeric(15, 2)).label('amount')]
+            if table == 'equity':
+                selection.append(sa.cast(tbl.c.pct, sa.Numeric(15, 2)).label('pct'))
+                columns.append('pct')
+            orm = sa.select(selection).where(sa.and_(tbl.c.trade_dt == dt,
+                                                     tbl.c.sid.in_([asset.sid for asset in grp])))
+            rp = self.engine.execute(orm)
+            spots.append(pd.DataFrame(rp.fetchall(), columns=columns))
+        kline = pd.concat(spots, ignore_index=True) if spots else pd.DataFrame(columns=['sid'] + fields)
+        kline.drop_duplicates(subset=['sid'], inplace=True)
+        kline.set_index('sid', inplace=True)
+        kline = self._adjust_frame_type(kline)
+        return kline.reindex(columns=fields)
+
     def get_stack_value(self, tbl_name, sessions):
         """
             intend to calculate market index
@@ -193,6 +239,32 @@ class AssetSessionReader(BarReader):
                 raise TypeError('%s cannot mutate into %s' % (col, col_type))
         return df
 
+    def retrieve_stack_kline(self, table, start_date=None, end_date=None):
+        """
+            retrieve the whole (or [start_date, end_date]) kline of table in one scan
+            intend to build ColumnarBarStore
+        """
+        tbl = self.metadata.tables['%s_price' % table]
+        columns = ['trade_dt', 'sid', 'open', 'high', 'low', 'close', 'volume', 'amount']
+        selection = [tbl.c.trade_dt, tbl.c.sid,
+                     sa.cast(tbl.c.open, sa.Numeric(10, 2)).label('open'),
+                     sa.cast(tbl.c.high, sa.Numeric(10, 2)).label('high'),
+                     sa.cast(tbl.c.low, sa.Numeric(10, 3)).label('low'),
+                     sa.cast(tbl.c.close, sa.Numeric(12, 2)).label('close'),
+                     sa.cast(tbl.c.volume, sa.Numeric(15, 0)).label('volume'),
+                     sa.cast(tbl.c.amount, sa.Numeric(15, 2)).label('amount')]
+        if table == 'equity':
+            selection.append(sa.cast(tbl.c.pct, sa.Numeric(15, 2)).label('pct'))
+            columns.append('pct')
+        orm = sa.select(selection)
+        if start_date and end_date:
+            orm = orm.where(tbl.c.trade_dt.between(start_date, end_date))
+        rp = self.engine.execute(orm)
+        frame = pd.DataFrame(rp.fetchall(), columns=columns)
+        frame.drop_duplicates(subset=['trade_dt', 'sid'], ignore_index=True, inplace=True)
+        kline = self._adjust_frame_type(frame)
+        return kline
+
     def _retrieve_kline(self, table, sids, fields, start_date, end_date):
         """
             retrieve specific categroy asset
@@ -5,10 +5,81 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
-import pandas as pd, bcolz, os, datetime
+import pandas as pd, bcolz, os, datetime, threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from gateway.driver.bar_reader import BarReader
 from gateway.driver.tools import transfer_to_timestamp
-from gateway.driver import BcolzDir, OHLC_RATIO
+from gateway.driver import BcolzDir, OHLC_RATIO, PoolOpenFiles, PoolMemoryBytes, Num
+
+OHLC_FIELDS = frozenset(['open', 'high', 'low', 'close'])
+
+
+class CtablePool(object):
+    """
+        LRU pool of opened bcolz ctables
+
+        the least recently used ctable is dropped once the pool holds more than max_open
+        ctables or their compressed bytes exceed max_bytes ; hits / misses / evictions are counted
+
+    Parameters
+    ----------
+    max_open : int
+        max number of opened ctables (open files)
+    max_bytes : int
+        max compressed bytes of opened ctables
+    """
+    def __init__(self, max_open=PoolOpenFiles, max_bytes=PoolMemoryBytes):
+        self.max_open = max_open
+        self.max_bytes = max_bytes
+        self._tables = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._tables)
+
+    @property
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'opened': len(self._tables), 'cbytes': self._nbytes}
+
+    def _evict(self):
+        while self._tables and (len(self._tables) > self.max_open or self._nbytes > self.max_bytes):
+            _, table = self._tables.popitem(last=False)
+            self._nbytes -= table.cbytes
+            self.evictions += 1
+
+    def get(self, root_dir):
+        with self._lock:
+            try:
+                table = self._tables[root_dir]
+            except KeyError:
+                pass
+            else:
+                self._tables.move_to_end(root_dir)
+                self.hits += 1
+                return table
+        # open outside the lock , read only ctable is safe to be opened twice
+        table = bcolz.open(rootdir=root_dir, mode='r')
+        with self._lock:
+            self.misses += 1
+            if root_dir not in self._tables:
+                self._tables[root_dir] = table
+                self._nbytes += table.cbytes
+                self._evict()
+        return table
+
+    def clear(self):
+        """
+            drop all opened ctables , e.g. bcolz files are rewritten by BcolzWriter
+        """
+        with self._lock:
+            self._tables.clear()
+            self._nbytes = 0
 
 
 class BcolzReader(BarReader):
@@ -17,6 +88,39 @@ class BcolzReader(BarReader):
     """
     default = frozenset(['open', 'high', 'low', 'close', 'amount', 'volume'])
 
+    def __init__(self, root_dir, max_open=PoolOpenFiles, max_bytes=PoolMemoryBytes, workers=Num):
+        self._root_dir = root_dir
+        self._pool = CtablePool(max_open, max_bytes)
+        # sids are decompressed in parallel (blosc releases the GIL) , 1 means serial
+        self.workers = workers
+        # one bounded pool per reader , created lazily and reused by every load_raw_arrays
+        self._executor = None
+        self._executor_workers = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def pool(self):
+        return self._pool
+
+    def _ensure_executor(self):
+        # pool is recreated when workers is changed
+        with self._executor_lock:
+            if self._executor is None or self._executor_workers != self.workers:
+                if self._executor is not None:
+                    self._executor.shutdown(wait=False)
+                self._executor = ThreadPoolExecutor(self.workers)
+                self._executor_workers = self.workers
+            return self._executor
+
+    def close(self):
+        """
+            shut down the pool of reading sids
+        """
+        with self._executor_lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
     def get_sid_attr(self, sid):
         prefix_sid = 'sh' + sid if sid.startswith('6') else 'sz' + sid
         bcolz_file = '{}.bcolz'.format(prefix_sid)
@@ -26,7 +130,7 @@ class BcolzReader(BarReader):
     def _read_bcolz_data(self, sid):
         """cparams(clevel=5, shuffle=1, cname='lz4', quantize=0)"""
         root_dir = self.get_sid_attr(sid)
-        table = bcolz.open(rootdir=root_dir, mode='r')
+        table = self._pool.get(root_dir)
         return table
 
     def get_value(self, sid, sdate, edate):
@@ -75,18 +179,20 @@ class BcolzReader(BarReader):
         else:
             assert meta['end_session'] >= sdate, ('%r exceed metadata end_session' % sdate)
             condition = "({0} <= trade_dt) & (trade_dt <= {1})".format(sdate, edate)
-        frame = pd.DataFrame(table.fetchwhere(condition))
-        if not frame.empty:
-            frame.set_index('ticker', inplace=True) if 'ticker' in frame.columns \
-                else frame.set_index('trade_dt', inplace=True)
-            # 调整系数  原来的系数有问题（10000） --- 100
-            # inverse_ratio = 1 / meta['ohlc_ratio']
-            inverse_ratio = 1 / OHLC_RATIO
-            # print('original frame', frame)
-            frame.loc[:, ['open', 'high', 'low', 'close']] = frame.loc[:, ['open', 'high', 'low', 'close']] * inverse_ratio
-            # transform timestamp to structtime based on the utc (UTC只是比北京时间提前了8个小时)
-            frame.index = [pd.Timestamp(datetime.datetime.utcfromtimestamp(i).strftime('%Y-%m-%d %H:%M')) for i in frame.index] \
-                if frame.index.name == 'ticker' else frame.index
+        array = table.fetchwhere(condition)[:]
+        # 调整系数  原来的系数有问题（10000） --- 100
+        # inverse_ratio = 1 / meta['ohlc_ratio']
+        inverse_ratio = 1 / OHLC_RATIO
+        columns = dict()
+        for name in array.dtype.names:
+            columns[name] = array[name] * inverse_ratio if name in OHLC_FIELDS else array[name]
+        if 'ticker' in columns:
+            # transform epoch seconds to minutes based on the utc (UTC只是比北京时间提前了8个小时)
+            ticker = columns.pop('ticker')
+            index = pd.DatetimeIndex(pd.to_datetime(ticker.astype('int64') // 60 * 60, unit='s'))
+        else:
+            index = pd.Index(columns.pop('trade_dt'), name='trade_dt')
+        frame = pd.DataFrame(columns, index=index)
         return frame
 
     def get_spot_value(self, dt, asset, fields):
@@ -101,10 +207,16 @@ class BcolzReader(BarReader):
     def load_raw_arrays(self, sessions, assets, columns):
         assert set(columns).issubset(self.default), 'unknown field'
         sdate, edate = sessions
-        frame_dict = dict()
-        for i, asset in enumerate(assets):
-            out = self.get_value(asset.sid, sdate, edate)
-            frame_dict[asset.sid] = out.loc[:, columns]
+        sids = [asset.sid for asset in assets]
+
+        def load(sid):
+            return self.get_value(sid, sdate, edate).loc[:, columns]
+
+        if self.workers > 1 and len(sids) > 1:
+            frames = list(self._ensure_executor().map(load, sids))
+        else:
+            frames = [load(sid) for sid in sids]
+        frame_dict = dict(zip(sids, frames))
         return frame_dict
 
 
@@ -128,8 +240,8 @@ class BcolzMinuteReader(BcolzReader):
         The number of minutes per each period. Defaults to 390, the mode
         of minutes in NYSE trading days.
     """
-    def __init__(self):
-        self._root_dir = os.path.join(BcolzDir, 'minute')
+    def __init__(self, max_open=PoolOpenFiles, max_bytes=PoolMemoryBytes, workers=Num):
+        super().__init__(os.path.join(BcolzDir, 'minute'), max_open, max_bytes, workers)
 
     @property
     def data_frequency(self):
@@ -147,6 +259,16 @@ class BcolzMinuteReader(BcolzReader):
         minutes = self.get_value(asset.sid, start_dts, end_dts)
         return minutes.loc[:, fields]
 
+    def get_spot_values(self, dt, assets, fields):
+        """
+        :param dt: str '%Y-%m-%d'
+        :param assets: list of Asset
+        :param fields: list
+        :return: dict sid : minutes frame of dt
+        """
+        minutes = self.load_raw_arrays([dt, dt], assets, fields)
+        return minutes
+
     def load_raw_arrays(self, sessions, assets, columns):
         arrays = super().load_raw_arrays(sessions, assets, columns)
         return arrays
@@ -172,8 +294,8 @@ class BcolzDailyReader(BcolzReader):
     - Volume is interpreted as as-traded volume.
     - Day is interpreted as seconds since midnight UTC, Jan 1, 1970.
     """
-    def __init__(self):
-        self._root_dir = os.path.join(BcolzDir, 'daily')
+    def __init__(self, max_open=PoolOpenFiles, max_bytes=PoolMemoryBytes, workers=Num):
+        super().__init__(os.path.join(BcolzDir, 'daily'), max_open, max_bytes, workers)
 
     @property
     def data_frequency(self):
@@ -211,3 +333,36 @@ __all__ = [
 #     raw = minute_reader.load_raw_arrays(session, [equity], fields)
 #     raw = minute_reader.load_raw_arrays(['2005-09-05', '2005-09-07'], [equity], fields)
 #     print('raw', raw)
+
+
+if __name__ == '__main__':
+
+    # benchmark : full minute history of one sid
+    import time, numpy as np
+
+    minute_reader = BcolzMinuteReader()
+    sid = '600000'
+    start = time.time()
+    minutes = minute_reader.get_value(sid, '1990-01-01', datetime.datetime.now().strftime('%Y-%m-%d'))
+    elapsed = time.time() - start
+    print('vectorized get_value : %d minutes in %.3fs' % (len(minutes), elapsed))
+    # former per row conversion of the same tickers
+    tickers = minutes.index.values.astype('datetime64[s]').astype(np.int64)
+    start = time.time()
+    [pd.Timestamp(datetime.datetime.utcfromtimestamp(i).strftime('%Y-%m-%d %H:%M')) for i in tickers]
+    print('list comprehension index conversion alone : %.3fs' % (time.time() - start))
+
+    # benchmark : 300 sids minute window with 1 --- N workers
+    sids = sorted(os.path.splitext(f)[0][2:] for f in os.listdir(minute_reader._root_dir))[:300]
+
+    class _Asset(object):
+        def __init__(self, sid):
+            self.sid = sid
+
+    assets = [_Asset(sid) for sid in sids]
+    for workers in sorted(set([1, 2, 4, os.cpu_count()])):
+        minute_reader.workers = workers
+        minute_reader.pool.clear()
+        start = time.time()
+        minute_reader.load_raw_arrays(['2015-01-05', '2015-02-02'], assets, ['close', 'volume'])
+        print('workers %d : %d sids in %.3fs' % (workers, len(assets), time.time() - start))
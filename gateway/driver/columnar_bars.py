@@ -0,0 +1,368 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Mar 12 15:37:47 2019
+
+@author: python
+"""
+import os, numpy as np, pandas as pd
+from toolz import groupby
+from gateway.driver import BcolzDir
+from gateway.driver.bar_reader import BarReader
+
+ColumnarFields = ['open', 'high', 'low', 'close', 'volume', 'amount', 'pct']
+
+COLUMNAR_FIELDS_TYPE = {
+            'open': np.float64,
+            'high': np.float64,
+            'low': np.float64,
+            'close': np.float64,
+            'volume': np.int64,
+            'amount': np.float64,
+            'pct': np.float64
+                    }
+
+
+class ColumnarBarStore(object):
+    """
+        session-indexed columnar store of daily bars
+
+        one dense (sessions × sids) array per OHLCV field , the row of array is session
+        and the column is sid ; a bar is missing when close is nan (volume is 0)
+
+        Parameters
+        ----------
+        sessions : np.ndarray[str]
+            sorted trade_dt ('%Y-%m-%d') aligned to the rows of arrays
+        sids : np.ndarray[str]
+            asset identifiers aligned to the columns of arrays
+        arrays : dict[str -> np.ndarray]
+            field : 2D array with shape (len(sessions), len(sids))
+    """
+    def __init__(self, sessions, sids, arrays):
+        self.sessions = np.asarray(sessions).astype(str)
+        self.sids = np.asarray(sids).astype(str)
+        self._arrays = arrays
+        self._sid_loc = {sid: loc for loc, sid in enumerate(self.sids)}
+
+    @property
+    def fields(self):
+        return list(self._arrays)
+
+    @property
+    def first_session(self):
+        return self.sessions[0] if len(self.sessions) else None
+
+    @property
+    def last_session(self):
+        return self.sessions[-1] if len(self.sessions) else None
+
+    @classmethod
+    def from_frame(cls, stack):
+        """
+        Build store from a stacked frame
+
+        Parameters
+        ----------
+        stack : pd.DataFrame
+            columns --- trade_dt , sid and fields (one row per sid and session)
+        """
+        fields = [col for col in ColumnarFields if col in stack.columns]
+        sessions, row_idx = np.unique(stack['trade_dt'].values.astype(str), return_inverse=True)
+        sids, col_idx = np.unique(stack['sid'].values.astype(str), return_inverse=True)
+        shape = (len(sessions), len(sids))
+        arrays = dict()
+        for field in fields:
+            dtype = COLUMNAR_FIELDS_TYPE[field]
+            array = np.zeros(shape, dtype=dtype) if dtype == np.int64 else np.full(shape, np.nan, dtype=dtype)
+            array[row_idx, col_idx] = stack[field].values.astype(dtype)
+            arrays[field] = array
+        return cls(sessions, sids, arrays)
+
+    @classmethod
+    def from_path(cls, path, mmap_mode='r'):
+        """
+            load store written by ``write`` , arrays are memory-mapped by default
+        """
+        sessions = np.load(os.path.join(path, 'sessions.npy'))
+        sids = np.load(os.path.join(path, 'sids.npy'))
+        arrays = dict()
+        for field in ColumnarFields:
+            try:
+                arrays[field] = np.load(os.path.join(path, '%s.npy' % field), mmap_mode=mmap_mode)
+            except IOError:
+                pass
+        return cls(sessions, sids, arrays)
+
+    @staticmethod
+    def _save(path, name, array):
+        # write aside and replace , files of the previous store may still be memory-mapped
+        file = os.path.join(path, '%s.npy' % name)
+        with open(file + '.tmp', 'wb') as f:
+            np.save(f, array)
+        os.replace(file + '.tmp', file)
+
+    def write(self, path):
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._save(path, 'sessions', self.sessions)
+        self._save(path, 'sids', self.sids)
+        for field, array in self._arrays.items():
+            self._save(path, field, array)
+
+    def session_slice(self, start_date, end_date):
+        """
+            rows of [start_date, end_date] (include end_date)
+        """
+        start = np.searchsorted(self.sessions, start_date, side='left')
+        end = np.searchsorted(self.sessions, end_date, side='right')
+        return slice(start, end)
+
+    def sid_indexer(self, sids):
+        """
+            columns of sids , -1 means sid is not in store
+        """
+        return np.array([self._sid_loc.get(sid, -1) for sid in sids], dtype=np.int64)
+
+    def get_block(self, start_date, end_date, sids, field):
+        """
+            (sessions in range × sids) array of field , missing sid filled with nan (or 0 for volume)
+        """
+        array = self._arrays[field]
+        rows = self.session_slice(start_date, end_date)
+        cols = self.sid_indexer(sids)
+        block = array[rows][:, np.maximum(cols, 0)] if len(cols) else np.empty((rows.stop - rows.start, 0),
+                                                                                 dtype=array.dtype)
+        missing = cols < 0
+        if missing.any():
+            block[:, missing] = 0 if array.dtype == np.int64 else np.nan
+        return block
+
+    def get_spot(self, dt, sid, fields):
+        loc = np.searchsorted(self.sessions, dt)
+        col = self._sid_loc.get(sid, -1)
+        if loc >= len(self.sessions) or self.sessions[loc] != dt or col < 0 \
+                or np.isnan(self._arrays['close'][loc, col]):
+            return None
+        return {field: self._arrays[field][loc, col] for field in fields}
+
+    def get_spots(self, dt, sids, fields):
+        """
+            (sids × fields) frame of dt indexed by sid , sid without bar is dropped
+        """
+        loc = np.searchsorted(self.sessions, dt)
+        if loc >= len(self.sessions) or self.sessions[loc] != dt:
+            return pd.DataFrame(columns=fields)
+        cols = self.sid_indexer(sids)
+        valid = cols >= 0
+        valid[valid] = ~np.isnan(self._arrays['close'][loc, cols[valid]])
+        cols = cols[valid]
+        spots = pd.DataFrame({field: self._arrays[field][loc, cols] if field in self._arrays
+                              else np.full(len(cols), np.nan) for field in fields},
+                             index=pd.Index(np.asarray(sids)[valid], name='sid'),
+                             columns=fields)
+        return spots
+
+    def get_frames(self, start_date, end_date, sids, fields):
+        """
+            sid : DataFrame indexed by trade_dt , same layout as AssetSessionReader.load_raw_arrays
+        """
+        rows = self.session_slice(start_date, end_date)
+        sessions = self.sessions[rows]
+        frames = dict()
+        for sid in sids:
+            col = self._sid_loc.get(sid, -1)
+            if col < 0:
+                continue
+            valid = ~np.isnan(self._arrays['close'][rows, col])
+            if not valid.any():
+                continue
+            frame = pd.DataFrame({field: self._arrays[field][rows, col][valid] for field in fields},
+                                 index=pd.Index(sessions[valid], name='trade_dt'),
+                                 columns=fields)
+            frames[sid] = frame
+        return frames
+
+    def get_stack(self, start_date, end_date, fields):
+        """
+            stacked frame indexed by trade_dt with sid column
+        """
+        rows = self.session_slice(start_date, end_date)
+        row_idx, col_idx = np.nonzero(~np.isnan(self._arrays['close'][rows]))
+        stack = pd.DataFrame({'sid': self.sids[col_idx]}, index=pd.Index(self.sessions[rows][row_idx], name='trade_dt'))
+        for field in fields:
+            stack[field] = self._arrays[field][rows][row_idx, col_idx]
+        return stack
+
+
+class ColumnarSessionReader(BarReader):
+    """
+        Reader for daily bars served from ColumnarBarStore
+
+        every asset table (equity convertible fund) is scanned once from mysql via session_reader
+        (or memory-mapped from the store written under root_dir) and then all window requests
+        are array slices --- the backtest never goes back to mysql for kline
+
+    Parameters
+    ----------
+    session_reader : AssetSessionReader
+        used to build the store and retrieve m_cap
+    root_dir : str, optional
+        directory of persisted store ,default BcolzDir/session
+    """
+    def __init__(self, session_reader, root_dir=None):
+        self._reader = session_reader
+        self._root_dir = root_dir or os.path.join(BcolzDir, 'session')
+        self._stores = dict()
+        self._refreshed = set()
+
+    @property
+    def data_frequency(self):
+        return 'daily'
+
+    @staticmethod
+    def _table_name(asset):
+        return asset.asset_type if asset.asset_type in ['equity', 'convertible'] else 'fund'
+
+    def _build_store(self, table):
+        stack = self._reader.retrieve_stack_kline(table)
+        store = ColumnarBarStore.from_frame(stack)
+        try:
+            store.write(os.path.join(self._root_dir, table))
+        except (IOError, OSError) as e:
+            print('columnar store of %s cannot persist due to %r' % (table, e))
+        return store
+
+    def _ensure_store(self, table, end_date=None):
+        """
+            load store lazily ; rebuild once when the persisted store is behind end_date
+        """
+        try:
+            store = self._stores[table]
+        except KeyError:
+            path = os.path.join(self._root_dir, table)
+            try:
+                store = ColumnarBarStore.from_path(path)
+            except IOError:
+                store = self._build_store(table)
+                self._refreshed.add(table)
+            self._stores[table] = store
+        if end_date and table not in self._refreshed and \
+                (store.last_session is None or end_date > store.last_session):
+            store = self._stores[table] = self._build_store(table)
+            self._refreshed.add(table)
+        return store
+
+    @property
+    def version(self):
+        """
+            (table , shape of sessions and sids , mtime of sessions.npy) of every store persisted
+            under root_dir , independent of the stores loaded in this process ; a loaded store which
+            cannot persist is versioned by its last_session and number of sids
+        """
+        version = []
+        try:
+            tables = sorted(os.listdir(self._root_dir))
+        except OSError:
+            tables = []
+        for table in tables:
+            path = os.path.join(self._root_dir, table)
+            try:
+                mtime = os.stat(os.path.join(path, 'sessions.npy')).st_mtime_ns
+                shape = (np.load(os.path.join(path, 'sessions.npy'), mmap_mode='r').shape,
+                         np.load(os.path.join(path, 'sids.npy'), mmap_mode='r').shape)
+            except (IOError, OSError, ValueError):
+                continue
+            version.append((table, shape, mtime))
+        persisted = set(item[0] for item in version)
+        for table, store in sorted(self._stores.items()):
+            if table not in persisted:
+                version.append((table, store.last_session, len(store.sids)))
+        return tuple(version)
+
+    def get_mkv_value(self, sessions, assets, fields):
+        return self._reader.get_mkv_value(sessions, assets, fields)
+
+    def get_spot_value(self, dt, asset, fields):
+        store = self._ensure_store(self._table_name(asset), dt)
+        _fields = [fields] if isinstance(fields, str) else fields
+        spot = store.get_spot(dt, asset.sid, _fields)
+        if spot is None:
+            return pd.DataFrame()
+        return spot[fields] if isinstance(fields, str) else pd.Series(spot, name=0)
+
+    def get_spot_values(self, dt, assets, fields):
+        """
+            one array slice per asset type ; (assets × fields) frame indexed by sid ,
+            asset without bar on dt is dropped
+        """
+        spots = []
+        for table, grp in groupby(self._table_name, assets).items():
+            store = self._ensure_store(table, dt)
+            spots.append(store.get_spots(dt, [asset.sid for asset in grp], fields))
+        values = pd.concat(spots) if spots else pd.DataFrame(columns=fields)
+        return values
+
+    def get_stack_value(self, tbl_name, sessions):
+        start_date, end_date = sessions
+        store = self._ensure_store(tbl_name, end_date)
+        fields = ['open', 'close', 'high', 'low', 'volume', 'amount']
+        return store.get_stack(start_date, end_date, fields)
+
+    def traded_mask(self, sessions, assets):
+        """
+            (sessions × assets) bool , True when asset has a daily bar on session (close is not nan) ;
+            one block slice of close per asset type over [first session, last session]
+        """
+        sessions = np.asarray(sessions).astype(str)
+        mask = np.zeros((len(sessions), len(assets)), dtype=bool)
+        if not len(sessions):
+            return mask
+        for table, locs in groupby(lambda loc: self._table_name(assets[loc]), range(len(assets))).items():
+            store = self._ensure_store(table, sessions[-1])
+            block = store.get_block(sessions[0], sessions[-1], [assets[loc].sid for loc in locs], 'close')
+            rows = store.sessions[store.session_slice(sessions[0], sessions[-1])]
+            found = np.searchsorted(rows, sessions)
+            inside = found < len(rows)
+            inside[inside] = rows[found[inside]] == sessions[inside]
+            mask[np.ix_(np.nonzero(inside)[0], locs)] = ~np.isnan(block[found[inside]])
+        return mask
+
+    def load_raw_blocks(self, session_labels, asset_objs, columns):
+        """
+        Parameters
+        ----------
+        session_labels: list --- [start_date, end_date]
+        asset_objs : list of Asset (same asset type)
+        columns : list of str
+
+        Returns
+        -------
+        sessions : np.ndarray
+        blocks : dict[str -> np.ndarray] , field : (sessions × assets) array
+        """
+        start_date, end_date = session_labels
+        tables = set(self._table_name(asset) for asset in asset_objs)
+        assert len(tables) == 1, 'blocks are restricted to one asset type'
+        store = self._ensure_store(tables.pop(), end_date)
+        sids = [asset.sid for asset in asset_objs]
+        sessions = store.sessions[store.session_slice(start_date, end_date)]
+        blocks = {field: store.get_block(start_date, end_date, sids, field) for field in columns}
+        return sessions, blocks
+
+    def load_raw_arrays(self, session_labels, asset_objs, columns):
+        start_date, end_date = session_labels
+        columns = [col for col in columns if col != 'trade_dt']
+        groups = groupby(self._table_name, asset_objs)
+        batch_arrays = {}
+        for name, assets in groups.items():
+            store = self._ensure_store(name, end_date)
+            data = store.get_frames(start_date, end_date, [a.sid for a in assets], columns)
+            batch_arrays.update(data)
+        return batch_arrays
+
+
+__all__ = [
+    'ColumnarBarStore',
+    'ColumnarSessionReader'
+]
@@ -5,18 +5,24 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
-import pandas as pd, json
+import pandas as pd, numpy as np, json, hashlib
+from _calendar.trading_calendar import calendar
 from gateway.driver.tools import _parse_url
 from gateway.driver.client import tsclient
 from gateway.driver.resample import Freq
 from gateway.driver.bar_reader import AssetSessionReader
+from gateway.driver.columnar_bars import ColumnarSessionReader
+from gateway.driver import MinuteStore
 from gateway.driver.bcolz_reader import BcolzMinuteReader
+from gateway.driver.minute_bars import ConsolidatedMinuteReader
 from gateway.driver.adjustment_reader import SQLiteAdjustmentReader
 from gateway.driver.history import (
     HistoryDailyLoader,
     HistoryMinuteLoader
 )
 
+PriceLimitFields = ['open_pct', 'pre_close', 'limit_up', 'limit_down']
+
 
 class DataPortal(object):
     """Interface to all of the data that a ArkQuant needs.
@@ -34,8 +40,10 @@ class DataPortal(object):
     OHLCV_FIELDS = frozenset(['open', 'high', 'low', 'close', 'volume', 'amount'])
 
     def __init__(self):
-        _minute_reader = BcolzMinuteReader()
-        _session_reader = AssetSessionReader()
+        _minute_reader = ConsolidatedMinuteReader() if MinuteStore == 'consolidated' else BcolzMinuteReader()
+        # daily kline served from columnar store which scan mysql once
+        _session_reader = ColumnarSessionReader(AssetSessionReader())
+        self._session_reader = _session_reader
 
         self._adjustment_reader = SQLiteAdjustmentReader()
 
@@ -54,11 +62,21 @@ class DataPortal(object):
         }
         self.freq_rule = Freq()
         self._extra_source = None
+        # price limit table of the current session --- (dt, sid : PriceLimitFields)
+        self._price_limits = (None, pd.DataFrame(columns=PriceLimitFields))
 
     @property
     def adjustment_reader(self):
         return self._adjustment_reader
 
+    def data_version(self):
+        """
+            digest of daily bar stores persisted on disk and adjustment factors , used to invalidate
+            results memoized on disk (ResultMemo) ; independent of the tables touched in this process
+        """
+        version = repr((self._session_reader.version, self._adjustment_reader.version))
+        return hashlib.md5(version.encode('utf-8')).hexdigest()
+
     def get_dividends(self, assets, trading_day):
         """
         splits --- divdends
@@ -113,17 +131,117 @@ class DataPortal(object):
         stack = self._history_loader[frequency].get_stack_value(tbl, dt, length)
         return stack
 
-    def get_open_pct(self, asset, dt):
-        if asset.asset_type == 'equity':
+    def get_spot_values(self, dt, assets, frequency, fields):
+        """
+        Batched spot value of assets --- one query or array slice instead of one per asset
+
+        Parameters
+        ----------
+        dt : str '%Y-%m-%d'
+        assets : list of Asset
+        frequency : daily or minute
+        fields : list
+
+        Returns
+        -------
+        daily : pd.DataFrame (assets × fields) indexed by sid , asset without bar on dt is dropped
+        minute : dict sid : minutes frame of dt
+        """
+        spot_values = self._history_loader[frequency].get_spot_values(dt, assets, fields)
+        return spot_values
+
+    def get_traded_mask(self, sessions, assets):
+        """
+        Daily bar existence of assets over sessions , one slice of the columnar store per asset type
+        instead of one get_spot_values per session
+
+        Returns
+        -------
+        mask : np.ndarray[bool] (sessions × assets) , True when asset has a daily bar on session
+        """
+        mask = self._session_reader.traded_mask(sessions, list(assets))
+        return mask
+
+    def get_open_pcts(self, assets, dt):
+        """
+        Returns
+        -------
+        open_pcts : pd.DataFrame
+            columns --- open_pct , pre_close indexed by sid
+        """
+        equities = [asset for asset in assets if asset.asset_type == 'equity']
+        others = [asset for asset in assets if asset.asset_type != 'equity']
+        frames = []
+        if equities:
             # 存在0.1%误差
-            spot_value = self.get_spot_value(dt, asset, 'daily', ['open', 'high', 'low', 'close', 'pct'])
-            preclose = (spot_value['high'] - spot_value['low']) * 100 / spot_value['pct']
-            open_pct = spot_value['open'] / preclose - 1
-        else:
-            spot_value = self.get_spot_value(dt, asset, 'daily', ['open', 'close'])
-            pre_value = self.get_history_window([asset], dt, -1, ['close'], 'daily')
-            preclose = pre_value[asset.sid]['close'].iloc[-1]
-            open_pct = spot_value['open'] / preclose - 1
+            spot_values = self.get_spot_values(dt, equities, 'daily', ['open', 'high', 'low', 'close', 'pct'])
+            preclose = (spot_values['high'] - spot_values['low']) * 100 / spot_values['pct']
+            frames.append(pd.DataFrame({'open_pct': spot_values['open'] / preclose - 1,
+                                        'pre_close': preclose}))
+        if others:
+            spot_values = self.get_spot_values(dt, others, 'daily', ['open'])
+            pre_date = calendar.dt_window_size(dt, -1)
+            preclose = self.get_spot_values(pre_date, others, 'daily', ['close'])['close']
+            preclose = preclose.reindex(spot_values.index)
+            frames.append(pd.DataFrame({'open_pct': spot_values['open'] / preclose - 1,
+                                        'pre_close': preclose}))
+        open_pcts = pd.concat(frames) if frames else pd.DataFrame(columns=['open_pct', 'pre_close'])
+        return open_pcts
+
+    @staticmethod
+    def _restricted_changes(assets, dt):
+        # None means no price limit (convertible) , nan when the rule of asset is unknown (fund)
+        changes = np.full(len(assets), np.nan)
+        for loc, asset in enumerate(assets):
+            try:
+                change = asset.restricted_change(dt)
+            except NotImplementedError:
+                continue
+            changes[loc] = np.inf if change is None else change
+        return changes
+
+    def _read_price_limits(self, assets, dt):
+        sids = [asset.sid for asset in assets]
+        open_pcts = self.get_open_pcts(assets, dt).reindex(sids)
+        pre_close = open_pcts['pre_close'].values.astype(np.float64)
+        changes = self._restricted_changes(assets, dt)
+        limits = pd.DataFrame({'open_pct': open_pcts['open_pct'].values.astype(np.float64),
+                               'pre_close': pre_close,
+                               'limit_up': pre_close * (1 + changes),
+                               'limit_down': pre_close * (1 - changes)},
+                              index=pd.Index(sids, name='sid'),
+                              columns=PriceLimitFields)
+        return limits
+
+    def prime_price_limits(self, assets, dt):
+        """
+            price limit table of the universe on dt by one bulk read , computed at BEFORE_TRADING_START
+            and shared by execution , division and blotter
+        """
+        assets = list({asset.sid: asset for asset in assets}.values())
+        self._price_limits = (dt, self._read_price_limits(assets, dt))
+
+    def get_price_limits(self, assets, dt):
+        """
+        Returns
+        -------
+        limits : pd.DataFrame
+            columns --- open_pct , pre_close , limit_up , limit_down indexed by sid , aligned to assets ;
+            assets out of the primed table are read in one batch and appended
+        """
+        session, limits = self._price_limits
+        if session != dt:
+            limits = pd.DataFrame(columns=PriceLimitFields)
+        known = set(limits.index)
+        missing = list({asset.sid: asset for asset in assets if asset.sid not in known}.values())
+        if missing:
+            fetched = self._read_price_limits(missing, dt)
+            limits = pd.concat([limits, fetched]) if len(limits) else fetched
+            self._price_limits = (dt, limits)
+        return limits.reindex([asset.sid for asset in assets])
+
+    def get_open_pct(self, asset, dt):
+        open_pct, preclose = self.get_price_limits([asset], dt).iloc[0][['open_pct', 'pre_close']]
         return open_pct, preclose
 
     def get_window(self,
@@ -211,6 +329,26 @@ class DataPortal(object):
         history_window_arrays = history.history(assets, fields, end_date, bar_count)
         return history_window_arrays
 
+    def get_history_chunk(self,
+                          assets,
+                          sessions,
+                          bar_count,
+                          field,
+                          data_frequency):
+        """
+        Fully adjusted history windows of every session in sessions , the raw
+        kline of the whole chunk is read once (see ``get_history_window``)
+
+        Returns
+        -------
+        A generator of (session , dict sid : window frame)
+        """
+        fields = field if isinstance(field, (set, list)) else [field]
+        if not set(fields).issubset(self.OHLCV_FIELDS):
+            raise ValueError("Invalid field: {0}".format(field))
+        history = self._history_loader[data_frequency]
+        return history.history_chunk(assets, fields, sessions, bar_count)
+
     def handle_extra_source(self):
         """
             extra data source
@@ -5,6 +5,8 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
+import pandas as pd
+from toolz import valmap, keyfilter
 from _calendar.trading_calendar import calendar
 from gateway.driver.adjustArray import (
                         AdjustedDailyWindow,
@@ -13,6 +15,60 @@ from gateway.driver.adjustArray import (
 DefaultFields = frozenset(['open', 'high', 'low', 'close', 'amount', 'volume'])
 
 
+class SlidingWindowCache(object):
+    """
+        rolling cache of adjusted windows keyed by (frequency, fields, window)
+
+        frames : sid --- adjusted frame over [sdate, edate]
+        前复权 coef of a bar only depends on the ex_date which lands after it in the window ,
+        so a window is rolled by appending the raw bars of new sessions and dropping the
+        expired ones ; only sid whose ex_date adjustment lands inside the window is rebuilt
+    """
+    __slots__ = ['sdate', 'edate', 'frames']
+
+    def __init__(self, sdate, edate, frames):
+        self.sdate = sdate
+        self.edate = edate
+        self.frames = frames
+
+    def can_roll(self, sdate, edate):
+        # the new window must move forward and overlap the cached one
+        return self.sdate <= sdate <= self.edate <= edate
+
+    @staticmethod
+    def _truncate(frame, sdate):
+        if isinstance(frame.index, pd.DatetimeIndex):
+            return frame[frame.index >= pd.Timestamp(sdate)]
+        return frame[frame.index >= sdate]
+
+    def roll(self, sdate, edate, sids, raw_frames, rebuilt_frames):
+        """
+        :param sdate: start of the new window
+        :param edate: end of the new window
+        :param sids: sids requested by this roll , the others are dropped ---
+                     ex_date of sid absent from a roll is never checked , so it must be rebuilt
+        :param raw_frames: sid --- unadjusted bars of [self.edate, edate]
+        :param rebuilt_frames: sid --- adjusted frame of the whole new window
+        """
+        frames = dict()
+        for sid, frame in self.frames.items():
+            if sid in rebuilt_frames or sid not in sids:
+                continue
+            try:
+                raw = raw_frames[sid]
+            except KeyError:
+                rolled = frame
+            else:
+                # bars after the last ex_date are not adjusted (coef --- 1.0)
+                raw = raw[~raw.index.isin(frame.index)]
+                rolled = pd.concat([frame, raw.reindex(columns=frame.columns)]) if len(raw) else frame
+            frames[sid] = self._truncate(rolled, sdate)
+        frames.update(rebuilt_frames)
+        self.sdate = sdate
+        self.edate = edate
+        self.frames = frames
+
+
 class HistoryLoader(object):
 
     @property
@@ -27,6 +83,10 @@ class HistoryLoader(object):
         spot = self.adjust_window.get_spot_value(dt, asset, fields)
         return spot
 
+    def get_spot_values(self, dt, assets, fields):
+        spots = self.adjust_window.get_spot_values(dt, assets, fields)
+        return spots
+
     def get_stack_value(self, tbl, dt, window):
         sdate = self.trading_calendar.dt_window_size(dt, window)
         stack = self.adjust_window.get_stack_value(tbl, [sdate, dt])
@@ -36,6 +96,8 @@ class HistoryLoader(object):
         """
         Ensure that there is a Float64Multiply window for each asset that can
         provide data for the given parameters.
+        Windows are cached by (frequency, fields, window) and rolled forward
+        session by session instead of being refetched and re-adjusted.
         If the corresponding window for the (asset, len(dts), field) does not
         exist, then create a new one.
         If a corresponding window does exist for (asset, len(dts), field), but
@@ -59,15 +121,41 @@ class HistoryLoader(object):
         value in `dts`
         """
         sdate = self.trading_calendar.dt_window_size(dts, window)
-        session = [sdate, dts]
+        fields = [fields] if isinstance(fields, str) else list(fields)
+        key = (self.frequency, tuple(sorted(fields)), window)
+        cache = self._window_cache.get(key)
+        sids = set(asset.sid for asset in assets)
+        if cache is not None and cache.can_roll(sdate, dts):
+            if dts != cache.edate:
+                # sid with ex_date lands inside window --- pay_date between (cache.edate, dts]
+                adjustments = self.adjust_window.load_pricing_adjustments([cache.edate, dts])
+                adjusted = set(adjustments['dividends']) | set(adjustments['rights'])
+            else:
+                adjusted = set()
+            # missing sid or sid without kline in cache
+            rebuild = set([sid for sid in sids if cache.frames.get(sid, pd.DataFrame()).empty]) | adjusted
+            rebuild_assets = [asset for asset in assets if asset.sid in rebuild]
+            rolled_assets = [asset for asset in assets if asset.sid not in rebuild]
+            raw_frames = self.adjust_window.array([cache.edate, dts], rolled_assets, fields) \
+                if rolled_assets and dts != cache.edate else dict()
+            rebuilt_frames = self._adjust_window_arrays(rebuild_assets, fields, [sdate, dts]) \
+                if rebuild_assets else dict()
+            cache.roll(sdate, dts, sids, raw_frames, rebuilt_frames)
+        else:
+            frames = self._adjust_window_arrays(assets, fields, [sdate, dts])
+            cache = self._window_cache[key] = SlidingWindowCache(sdate, dts, frames)
+        sliding_window = keyfilter(lambda x: x in sids, cache.frames)
+        return sliding_window
+
+    def _adjust_window_arrays(self, assets, fields, session, data=None):
         adjust_arrays = self.adjust_window.window_arrays(
             session,
             assets,
-            list(DefaultFields)
+            list(DefaultFields),
+            data
         )
-        from toolz import valmap
-        sliding_window = valmap(lambda x: x.reindex(columns=fields), adjust_arrays)
-        return sliding_window
+        adjusted_windows = valmap(lambda x: x.reindex(columns=fields), adjust_arrays)
+        return adjusted_windows
 
     def window(self, assets, field, dts, window):
         if window == -1:
@@ -116,6 +204,31 @@ class HistoryLoader(object):
         return block_arrays
 
 
+    def history_chunk(self, assets, field, sessions, window):
+        """
+        Adjusted windows of every session in chunk , unadjusted kline of
+        [first window start, last session] is read and 前复权 once as a block , each window
+        is sliced from it and adjusted as of its own end (same as ``history``)
+
+        Parameters
+        ----------
+        assets : iterable of Assets
+        field : str or list
+        sessions : list of sessions of chunk (sorted)
+        window : int , negative
+
+        Returns
+        -------
+        out : generator of (session , dict sid : adjusted window)
+        """
+        assert window < -1, 'to avoid forward prospective error'
+        fields = [field] if isinstance(field, str) else list(field)
+        windows = [(self.trading_calendar.dt_window_size(dts, window), dts) for dts in sessions]
+        chunk = self.adjust_window.window_chunk(windows, assets, list(DefaultFields))
+        for (start, dts), adjust_arrays in chunk:
+            yield dts, valmap(lambda x: x.reindex(columns=fields), adjust_arrays)
+
+
 class HistoryDailyLoader(HistoryLoader):
     """
         生成调整后的序列
@@ -128,6 +241,7 @@ class HistoryDailyLoader(HistoryLoader):
         self.adjust_window = AdjustedDailyWindow(
                                             _daily_reader,
                                             equity_adjustment_reader)
+        self._window_cache = dict()
 
     @property
     def frequency(self):
@@ -154,6 +268,7 @@ class HistoryMinuteLoader(HistoryLoader):
         self.adjust_window = AdjustedMinuteWindow(
                                             _minute_reader,
                                             equity_adjustment_reader)
+        self._window_cache = dict()
 
     @property
     def frequency(self):
@@ -194,3 +309,12 @@ __all__ = [
 #     print('sid', his_window_daily)
 #     window_daily = daily_history.window(asset, fields, sessions[1], window=-26)
 #     print('window_daily', window_daily)
+#
+#     # sid skipped by a roll across its ex_date is rebuilt --- rolled window equals the fresh one
+#     a, b = Equity('600000'), Equity('000001')
+#     daily_history.history([a, b], fields, '2019-06-03', window=-26)
+#     daily_history.history([b], fields, '2019-07-01', window=-26)
+#     rolled = daily_history.history([a, b], fields, '2019-07-15', window=-26)
+#     sdate = calendar.dt_window_size('2019-07-15', -26)
+#     fresh = daily_history._adjust_window_arrays([a, b], fields, [sdate, '2019-07-15'])
+#     assert all(rolled[sid].equals(fresh[sid]) for sid in fresh), 'rolled window diverges from fresh window'
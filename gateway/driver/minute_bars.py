@@ -0,0 +1,340 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Mar 12 15:37:47 2019
+
+@author: python
+"""
+import os, bcolz, numpy as np, pandas as pd
+from gateway.driver import BcolzDir, OHLC_RATIO
+from gateway.driver.bar_reader import BarReader
+from gateway.driver.bcolz_reader import CtablePool, OHLC_FIELDS
+
+ConsolidatedMinuteFields = ['ticker', 'open', 'high', 'low', 'close', 'amount', 'volume']
+
+ConsolidatedMinuteDir = os.path.join(BcolzDir, 'minute_consolidated')
+
+
+def _ticker_session(ticker):
+    # ticker --- epoch seconds of utc minute , session --- '%Y-%m-%d'
+    return (np.asarray(ticker, dtype=np.int64) // 86400).astype('datetime64[D]').astype(str)
+
+
+class MinuteIndex(object):
+    """
+        (session , sid) --- row range of the consolidated ctable
+
+        rows are laid out session major and sorted by sid within session , the rows of
+        entry k are [starts[k], starts[k + 1]) and the entries of session i are
+        [bounds[i], bounds[i + 1])
+
+    Parameters
+    ----------
+    sessions : np.ndarray[str]
+    bounds : np.ndarray[int64] , len(sessions) + 1
+    sids : np.ndarray[str] , one per entry
+    starts : np.ndarray[int64] , len(sids) + 1
+    """
+    def __init__(self, sessions, bounds, sids, starts):
+        self.sessions = np.asarray(sessions).astype(str)
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        self.sids = np.asarray(sids).astype(str)
+        self.starts = np.asarray(starts, dtype=np.int64)
+
+    @classmethod
+    def empty(cls):
+        return cls([], [0], [], [0])
+
+    @property
+    def last_session(self):
+        return self.sessions[-1] if len(self.sessions) else None
+
+    @property
+    def nrows(self):
+        return self.starts[-1]
+
+    @classmethod
+    def from_path(cls, path):
+        with np.load(path) as index:
+            return cls(index['sessions'], index['bounds'], index['sids'], index['starts'])
+
+    def write(self, path):
+        # write aside and replace , the reader may be loading the previous index
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, sessions=self.sessions, bounds=self.bounds, sids=self.sids, starts=self.starts)
+        os.replace(path + '.tmp', path)
+
+    def extend(self, sessions, bounds, sids, starts):
+        """
+            append entries of new sessions (bounds and starts are relative to the new rows)
+        """
+        offset = len(self.sids)
+        return MinuteIndex(np.concatenate([self.sessions, sessions]),
+                           np.concatenate([self.bounds, bounds[1:] + offset]),
+                           np.concatenate([self.sids, sids]),
+                           np.concatenate([self.starts, starts[1:] + self.nrows]))
+
+    def session_entries(self, start_date, end_date):
+        """
+            entry slice of sessions in [start_date, end_date]
+        """
+        lo = np.searchsorted(self.sessions, start_date, side='left')
+        hi = np.searchsorted(self.sessions, end_date, side='right')
+        return slice(self.bounds[lo], self.bounds[hi])
+
+    def entries(self, start_date, end_date, sids):
+        """
+            entries of sids in [start_date, end_date]
+        """
+        loc = self.session_entries(start_date, end_date)
+        positions = np.arange(loc.start, loc.stop)
+        positions = positions[np.isin(self.sids[loc], list(sids))]
+        return positions
+
+
+class ConsolidatedMinuteWriter(object):
+    """
+        minute bars of all sids in one chunked bcolz ctable with a (session , sid) offset index ,
+        alternative of the one ctable per sid layout of BcolzMinuteBarWriter
+
+        sessions are appended in order ; ohlc are stored as scaled integers (OHLC_RATIO)
+        same as BcolzMinuteBarWriter
+
+    Parameters
+    ----------
+    root_dir : str , optional
+        default BcolzDir/minute_consolidated
+    """
+    def __init__(self, root_dir=None, default_ratio=OHLC_RATIO):
+        self._root_dir = root_dir or ConsolidatedMinuteDir
+        self._default_ohlc_ratio = default_ratio
+
+    @property
+    def table_path(self):
+        return os.path.join(self._root_dir, 'bars.bcolz')
+
+    @property
+    def index_path(self):
+        return os.path.join(self._root_dir, 'index.npz')
+
+    def _ensure_index(self):
+        try:
+            index = MinuteIndex.from_path(self.index_path)
+        except IOError:
+            index = MinuteIndex.empty()
+        return index
+
+    def _ensure_ctable(self, frame):
+        try:
+            table = bcolz.open(rootdir=self.table_path, mode='a')
+        except (IOError, ValueError):
+            if not os.path.exists(self._root_dir):
+                os.makedirs(self._root_dir)
+            columns = [np.empty(0, dtype=frame[col].dtype) for col in ConsolidatedMinuteFields]
+            # 4000 sids × 240 minutes per session
+            table = bcolz.ctable(columns=columns,
+                                 names=ConsolidatedMinuteFields,
+                                 rootdir=self.table_path,
+                                 mode='w',
+                                 expectedlen=4000 * 240 * 250,
+                                 cparams=bcolz.cparams(clevel=5, cname='lz4'))
+            table.attrs['ohlc_ratio'] = self._default_ohlc_ratio
+        return table
+
+    def write(self, frame):
+        """
+        Parameters
+        ----------
+        frame : pd.DataFrame
+            columns --- sid , ticker (epoch seconds) , open , high , low , close , amount , volume ;
+            sessions of frame must be after the last session written
+        """
+        if frame.empty:
+            return
+        index = self._ensure_index()
+        sessions = _ticker_session(frame['ticker'].values)
+        if index.last_session is not None and \
+                _ticker_session(frame['ticker'].min()) <= index.last_session:
+            raise ValueError('sessions before %s have been written' % index.last_session)
+        sids = frame['sid'].values.astype(str)
+        order = np.lexsort((frame['ticker'].values, sids, sessions))
+        sessions, sids = sessions[order], sids[order]
+        # entry --- rows of one sid in one session
+        change = np.ones(len(order), dtype=bool)
+        change[1:] = (sessions[1:] != sessions[:-1]) | (sids[1:] != sids[:-1])
+        entry_rows = np.append(np.nonzero(change)[0], len(order))
+        entry_sessions = sessions[change]
+        session_change = np.ones(len(entry_sessions), dtype=bool)
+        session_change[1:] = entry_sessions[1:] != entry_sessions[:-1]
+        session_bounds = np.append(np.nonzero(session_change)[0], len(entry_sessions))
+
+        table = self._ensure_ctable(frame)
+        table.append([frame[col].values[order] for col in ConsolidatedMinuteFields])
+        table.flush()
+        index = index.extend(entry_sessions[session_change], session_bounds, sids[change], entry_rows)
+        index.write(self.index_path)
+
+    def write_from_bcolz(self, bcolz_dir, sessions):
+        """
+            migrate [start_date, end_date] of the per sid ctables (BcolzMinuteBarWriter) into the store
+
+        Parameters
+        ----------
+        bcolz_dir : str
+            root of per sid ctables , e.g. BcolzDir/minute
+        sessions : list --- [start_date, end_date]
+        """
+        start = pd.Timestamp(sessions[0]).timestamp()
+        end = pd.Timestamp(sessions[1]).timestamp() + 24 * 60 * 60
+        condition = '({0} <= ticker) & (ticker < {1})'.format(start, end)
+        frames = []
+        for file in sorted(os.listdir(bcolz_dir)):
+            table = bcolz.open(rootdir=os.path.join(bcolz_dir, file), mode='r')
+            array = table.fetchwhere(condition)[:]
+            if len(array):
+                frame = pd.DataFrame({col: array[col] for col in ConsolidatedMinuteFields})
+                # sh600000.bcolz --- 600000
+                frame['sid'] = os.path.splitext(file)[0][2:]
+                frames.append(frame)
+        if frames:
+            self.write(pd.concat(frames, ignore_index=True))
+
+
+class ConsolidatedMinuteReader(BarReader):
+    """
+        Reader for minute bars written by ConsolidatedMinuteWriter , the same output
+        as BcolzMinuteReader so HistoryMinuteLoader can be served by either store
+
+        the rows of (sids , sessions) are located by MinuteIndex and read from the
+        column chunks of one ctable instead of opening one ctable per sid
+
+    Parameters
+    ----------
+    root_dir : str , optional
+        default BcolzDir/minute_consolidated
+    """
+    def __init__(self, root_dir=None):
+        self._root_dir = root_dir or ConsolidatedMinuteDir
+        self._pool = CtablePool()
+        self._index = None
+
+    @property
+    def data_frequency(self):
+        return 'minute'
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = MinuteIndex.from_path(os.path.join(self._root_dir, 'index.npz'))
+        return self._index
+
+    @property
+    def table(self):
+        return self._pool.get(os.path.join(self._root_dir, 'bars.bcolz'))
+
+    def _read_rows(self, rows, columns):
+        """
+            read rows (sorted) of columns , a contiguous slice is read when rows are dense
+        """
+        table = self.table
+        out = dict()
+        if not len(rows):
+            return {col: np.empty(0, dtype=table.cols[col].dtype) for col in columns}
+        lo, hi = rows[0], rows[-1] + 1
+        dense = len(rows) * 4 >= hi - lo
+        for col in columns:
+            array = table.cols[col][lo:hi][rows - lo] if dense else table.cols[col][rows]
+            out[col] = array / OHLC_RATIO if col in OHLC_FIELDS else array
+        return out
+
+    def _entry_rows(self, positions):
+        index = self.index
+        counts = index.starts[positions + 1] - index.starts[positions]
+        rows = np.repeat(index.starts[positions] - np.cumsum(np.append(0, counts[:-1])), counts) + \
+            np.arange(counts.sum())
+        return rows, counts
+
+    @staticmethod
+    def _to_index(ticker):
+        return pd.DatetimeIndex(pd.to_datetime(ticker.astype('int64') // 60 * 60, unit='s'))
+
+    def load_raw_arrays(self, sessions, assets, columns):
+        sdate, edate = [str(session)[:10] for session in sessions]
+        sids = [asset.sid for asset in assets]
+        positions = self.index.entries(sdate, edate, sids)
+        # rows of one sid spread over sessions --- regroup by sid
+        entry_sids = self.index.sids[positions]
+        order = np.argsort(entry_sids, kind='stable')
+        positions, entry_sids = positions[order], entry_sids[order]
+        rows, counts = self._entry_rows(positions)
+        sort = np.argsort(rows, kind='stable')
+        data = self._read_rows(rows[sort], ['ticker'] + list(columns))
+        # back to sid order
+        inverse = np.empty_like(sort)
+        inverse[sort] = np.arange(len(sort))
+        data = {col: array[inverse] for col, array in data.items()}
+        sid_rows = pd.Series(counts).groupby(entry_sids).sum()
+        bounds = np.append(0, np.cumsum(sid_rows.values))
+        frame_dict = dict()
+        for loc, sid in enumerate(sid_rows.index):
+            rng = slice(bounds[loc], bounds[loc + 1])
+            frame_dict[sid] = pd.DataFrame({col: data[col][rng] for col in columns},
+                                           index=self._to_index(data['ticker'][rng]),
+                                           columns=columns)
+        for sid in sids:
+            if sid not in frame_dict:
+                frame_dict[sid] = pd.DataFrame(columns=columns)
+        return frame_dict
+
+    def get_spot_value(self, dt, asset, fields):
+        minutes = self.load_raw_arrays([dt, dt], [asset], fields)
+        return minutes[asset.sid]
+
+    def get_spot_values(self, dt, assets, fields):
+        minutes = self.load_raw_arrays([dt, dt], assets, fields)
+        return minutes
+
+    def get_minute_values(self, minute, assets, fields):
+        """
+            cross section of assets at minute , only the ticker chunks of the session
+            and the hit rows are read
+
+        Returns
+        -------
+        values : pd.DataFrame
+            (assets × fields) indexed by sid , asset without bar at minute is dropped
+        """
+        minute = pd.Timestamp(minute)
+        session = minute.strftime('%Y-%m-%d')
+        index = self.index
+        loc = index.session_entries(session, session)
+        lo, hi = index.starts[loc.start], index.starts[loc.stop]
+        tickers = self.table.cols['ticker'][lo:hi].astype(np.int64) // 60 * 60
+        hits = np.nonzero(tickers == int(minute.timestamp()) // 60 * 60)[0] + lo
+        hit_sids = index.sids[np.searchsorted(index.starts, hits, side='right') - 1]
+        mask = np.isin(hit_sids, [asset.sid for asset in assets])
+        data = self._read_rows(hits[mask], fields)
+        values = pd.DataFrame(data, index=pd.Index(hit_sids[mask], name='sid'), columns=fields)
+        return values
+
+    def get_stack_value(self, tbl_name, session):
+        raise NotImplementedError('stack value is restricted to daily reader')
+
+
+__all__ = [
+    'ConsolidatedMinuteWriter',
+    'ConsolidatedMinuteReader'
+]
+
+
+# if __name__ == '__main__':
+#
+#     from gateway.asset.assets import Equity
+#
+#     writer = ConsolidatedMinuteWriter()
+#     writer.write_from_bcolz(os.path.join(BcolzDir, 'minute'), ['2020-09-01', '2020-09-30'])
+#     reader = ConsolidatedMinuteReader()
+#     minutes = reader.load_raw_arrays(['2020-09-01', '2020-09-03'], [Equity('600000')], ['close'])
+#     print('minutes', minutes)
+#     cross_section = reader.get_minute_values('2020-09-03 10:30', [Equity('600000'), Equity('000001')], ['close'])
+#     print('cross_section', cross_section)
@@ -40,6 +40,9 @@ def unpack_df_to_component_dict(stack, col=None):
     """Returns the set of known tables in the adjustments file in DataFrame
     form.
 
+    rows are stable sorted by sid once and every sid takes its contiguous block ,
+    so the cost is linear in the rows of stack (the former iterrows + append is quadratic)
+
     Parameters
     ----------
     stack : pd.DataFrame , stack
@@ -52,11 +55,21 @@ def unpack_df_to_component_dict(stack, col=None):
         from int to datetime.
     """
     unpack = defaultdict(pd.DataFrame)
-    for index, raw in stack.iterrows():
-        unpack[index] = unpack[index].append(raw, ignore_index=True)
-    # set trade_dt to index
-    _unpack = valmap(lambda x: x.set_index(col), unpack) if col else unpack
-    return _unpack
+    codes, sids = pd.factorize(stack.index)
+    # rows with null sid are dropped
+    order = np.argsort(codes, kind='stable')
+    order = order[codes[order] >= 0]
+    counts = np.bincount(codes[order], minlength=len(sids))
+    bounds = np.concatenate([[0], np.cumsum(counts)])
+    ordered = stack.iloc[order]
+    if col:
+        ordered = ordered.set_index(col)
+    else:
+        # position within sid , same as ignore_index
+        ordered.index = np.arange(len(ordered)) - np.repeat(bounds[:-1], counts)
+    for loc, sid in enumerate(sids):
+        unpack[sid] = ordered.iloc[bounds[loc]:bounds[loc + 1]].copy()
+    return unpack
 
 
 def parse_content_from_header(header):
@@ -118,3 +131,35 @@ def unstack_value(result, assets, missing_value):
         columns=assets,
         fill_value=missing_value,
     ).values
+
+
+if __name__ == '__main__':
+
+    # micro-benchmark : stacked kline of 4000 sids × 250 sessions
+    def _unpack_by_iterrows(stack, col=None):
+        unpack = defaultdict(pd.DataFrame)
+        for index, raw in stack.iterrows():
+            unpack[index] = pd.concat([unpack[index], raw.to_frame().T], ignore_index=True)
+        return valmap(lambda x: x.set_index(col), unpack) if col else unpack
+
+    n_sids, n_sessions, n_legacy = 4000, 250, 200
+    sids = np.repeat(['%06d' % i for i in range(n_sids)], n_sessions)
+    sessions = np.tile(pd.date_range('2020-01-01', periods=n_sessions).strftime('%Y-%m-%d'), n_sids)
+    kline = pd.DataFrame({'sid': sids, 'trade_dt': sessions},)
+    for field in ['open', 'high', 'low', 'close', 'volume', 'amount']:
+        kline[field] = np.random.random(len(kline))
+    kline = kline.sample(frac=1.0).set_index('sid')
+    # iterrows + concat is quadratic per sid , legacy path only runs on a subsample of sids
+    subsample = kline[kline.index.isin(['%06d' % i for i in range(n_legacy)])]
+
+    start = time.time()
+    unpack_df_to_component_dict(kline, 'trade_dt')
+    print('groupby splitter (%d sids) : %.3fs' % (n_sids, time.time() - start))
+    start = time.time()
+    unpack_df_to_component_dict(subsample, 'trade_dt')
+    elapsed = time.time() - start
+    print('groupby splitter (%d sids) : %.3fs' % (n_legacy, elapsed))
+    start = time.time()
+    _unpack_by_iterrows(subsample, 'trade_dt')
+    legacy = time.time() - start
+    print('iterrows + concat (%d sids) : %.3fs , speedup %.1fx' % (n_legacy, legacy, legacy / elapsed))
@@ -5,13 +5,115 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
-import pandas as pd
+import pandas as pd, numpy as np, sqlalchemy as sa
 from gateway.spider import Crawler
 from gateway.database.db_writer import db
 from gateway.spider.url import DIVDEND
 from gateway.driver.tools import _parse_url
+from gateway.driver.adjustment_engine import dividends_ratio, rights_ratio, cast_adjustment
 
-__all__ = ['AdjustmentsWriter']
+__all__ = ['AdjustmentsWriter', 'AdjustmentFactorWriter']
+
+
+class AdjustmentFactorWriter(Crawler):
+    """
+        materialize 前复权 factor into equity_adjustment_factor
+        a. 分红(实施) and 配股 of sids from mysql
+        b. ex_close on ex_date from equity_price
+        c. ratio (same as AdjustmentEngine) and factor --- cumprod of ratio by ex_date
+
+        events whose ex_close is not available yet (ratio is null) are pending and
+        recalculated by the next run
+
+        bootstrap --- the incremental run only rewrites updated and pending sids , so when
+        equity_adjustment_factor is empty or misses sids which have 分红 / 配股 (first run after
+        deploy on an existing database) the whole table is rebuilt once ; otherwise readers
+        would take qfq = 1 for the missing sids
+    """
+    factor_table = 'equity_adjustment_factor'
+
+    def _retrieve_events(self, sids=None):
+        splits = self.metadata.tables['equity_splits']
+        sql = sa.select([splits.c.sid, splits.c.ex_date, splits.c.pay_date,
+                         cast_adjustment(splits.c.sid_bonus),
+                         cast_adjustment(splits.c.sid_transfer),
+                         cast_adjustment(splits.c.bonus)]).\
+            where(splits.c.progress.like('实施'))
+        sql = sql.where(splits.c.sid.in_(sids)) if sids is not None else sql
+        dividends = pd.DataFrame(self.engine.execute(sql).fetchall(),
+                                 columns=['sid', 'ex_date', 'pay_date', 'sid_bonus', 'sid_transfer', 'bonus'])
+        dividends['kind'] = 'dividends'
+
+        rights_tbl = self.metadata.tables['equity_rights']
+        sql = sa.select([rights_tbl.c.sid, rights_tbl.c.ex_date, rights_tbl.c.pay_date,
+                         cast_adjustment(rights_tbl.c.rights_bonus),
+                         cast_adjustment(rights_tbl.c.rights_price)])
+        sql = sql.where(rights_tbl.c.sid.in_(sids)) if sids is not None else sql
+        rights = pd.DataFrame(self.engine.execute(sql).fetchall(),
+                              columns=['sid', 'ex_date', 'pay_date', 'rights_bonus', 'rights_price'])
+        rights['kind'] = 'rights'
+        # ex_date and pay_date of the unimplemented events are '--'
+        valid = r'^\d{4}-\d{2}-\d{2}$'
+        dividends = dividends[dividends['ex_date'].str.match(valid) & dividends['pay_date'].str.match(valid)]
+        rights = rights[rights['ex_date'].str.match(valid) & rights['pay_date'].str.match(valid)]
+        return dividends, rights
+
+    def _retrieve_ex_close(self, events):
+        table = self.metadata.tables['equity_price']
+        sql = sa.select([table.c.sid, table.c.trade_dt, sa.cast(table.c.close, sa.Numeric(10, 5))]).\
+            where(sa.and_(table.c.sid.in_(list(set(events['sid']))),
+                          table.c.trade_dt.in_(list(set(events['ex_date'])))))
+        close = pd.DataFrame(self.engine.execute(sql).fetchall(), columns=['sid', 'ex_date', 'ex_close'])
+        close['ex_close'] = close['ex_close'].astype(np.float64)
+        ex_close = events[['sid', 'ex_date']].merge(close, on=['sid', 'ex_date'], how='left')['ex_close']
+        return ex_close.values
+
+    def _retrieve_pending(self):
+        table = self.metadata.tables[self.factor_table]
+        sql = sa.select([table.c.sid]).where(table.c.ratio.is_(None)).distinct()
+        pending = set([r[0] for r in self.engine.execute(sql).fetchall()])
+        return pending
+
+    def _retrieve_missing(self):
+        """
+            sids which have valid 分红 / 配股 events but no row in equity_adjustment_factor
+        """
+        dividends, rights = self._retrieve_events()
+        table = self.metadata.tables[self.factor_table]
+        materialized = set([r[0] for r in self.engine.execute(sa.select([table.c.sid]).distinct()).fetchall()])
+        missing = (set(dividends['sid']) | set(rights['sid'])) - materialized
+        return missing
+
+    def _writer_internal(self, sids=None):
+        dividends, rights = self._retrieve_events(sids)
+        for frame, calculate in [(dividends, dividends_ratio), (rights, rights_ratio)]:
+            frame['ex_close'] = self._retrieve_ex_close(frame) if len(frame) else []
+            frame['ratio'] = calculate(frame, frame['ex_close'].values) if len(frame) else []
+        columns = ['sid', 'ex_date', 'kind', 'pay_date', 'ex_close', 'ratio']
+        factors = pd.concat([dividends[columns], rights[columns]], ignore_index=True)
+        factors.sort_values(['sid', 'ex_date', 'kind'], inplace=True)
+        factors.loc[~np.isfinite(factors['ratio'].astype(np.float64)), 'ratio'] = np.nan
+        factors['factor'] = factors['ratio'].astype(np.float64).fillna(1.0).groupby(factors['sid']).cumprod()
+        # replace factor of sids
+        table = self.metadata.tables[self.factor_table]
+        ins = table.delete().where(table.c.sid.in_(sids)) if sids is not None else table.delete()
+        self.engine.execute(ins)
+        factors = factors.astype(object).where(pd.notnull(factors), None)
+        db.writer(self.factor_table, factors)
+
+    def writer(self, sids=None):
+        """
+            sids : sids with new 分红 / 配股 records , None means rebuild all ;
+            rebuild all as well when the factor table is empty or incomplete (bootstrap)
+        """
+        if sids is not None and self._retrieve_missing():
+            print('equity_adjustment_factor is incomplete , rebuild all factors')
+            sids = None
+        if sids is not None:
+            sids = list(set(sids) | self._retrieve_pending())
+            if not sids:
+                return
+        self._writer_internal(sids)
 
 
 class AdjustmentsWriter(Crawler):
@@ -25,6 +127,9 @@ class AdjustmentsWriter(Crawler):
     def __init__(self):
         self.deadlines = dict()
         self.missed = set()
+        # sids with new records --- update equity_adjustment_factor incrementally
+        self.updated = set()
+        self._factor_writer = AdjustmentFactorWriter()
 
     def _record_deadlines(self):
         """
@@ -51,6 +156,8 @@ class AdjustmentsWriter(Crawler):
             ex_deadline = self.deadlines['equity_rights'].get(symbol, None)
             rights = frame[frame['ex_date'] > ex_deadline] if ex_deadline else frame
             db.writer('equity_rights', rights)
+            if not rights.empty:
+                self.updated.add(symbol)
 
     def _parse_equity_divdend(self, content, sid):
         """获取分红配股数据"""
@@ -69,6 +176,8 @@ class AdjustmentsWriter(Crawler):
             ex_deadline = self.deadlines['equity_splits'].get(sid, None)
             divdends = frame[frame['ex_date'] > ex_deadline] if ex_deadline else frame
             db.writer('equity_splits', divdends)
+            if not divdends.empty:
+                self.updated.add(sid)
 
     def _parser_writer(self, sid):
         contents = _parse_url(DIVDEND % sid)
@@ -103,9 +212,15 @@ class AdjustmentsWriter(Crawler):
         equities = self._retrieve_assets_from_sqlite()['equity']
         self._writer_internal(equities)
         self.rerun()
+        # 前复权 factor of sids with new records and pending events
+        self._factor_writer.writer(self.updated)
+        self.updated = set()
 
 
 # if __name__ == '__main__':
 #
 #     w = AdjustmentsWriter()
 #     w.writer()
+#     # rebuild all factors
+#     factor_writer = AdjustmentFactorWriter()
+#     factor_writer.writer()
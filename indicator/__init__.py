@@ -85,6 +85,16 @@ class MA(BaseFeature):
         ma_windowed = frame.rolling(window=window).mean()
         return ma_windowed
 
+    @staticmethod
+    def latest(block, kwargs):
+        """
+            last value of MA for each column of (window × sids) block , nan when rows are not enough
+        """
+        window = kwargs['window']
+        if len(block) < window:
+            return np.full(block.shape[1], np.nan)
+        return block[-window:].mean(axis=0)
+
 
 class WS(BaseFeature):
     """
@@ -148,6 +158,17 @@ class ExponentialMovingAverage(BaseFeature):
             dimension = dimension + 1
         return out
 
+    def latest(self, block, kwargs):
+        """
+            last value of EMA for each column of (window × sids) block , nan when rows are not enough
+        """
+        assert kwargs.get('recursion', 1) == 1, 'recursion is restricted to the sid path'
+        window = kwargs['window']
+        if len(block) < window:
+            return np.full(block.shape[1], np.nan)
+        exponential_weights = self._reformat_wgt(self._calculate_weights(block, kwargs))
+        return exponential_weights.dot(block[-window:]) / exponential_weights.sum()
+
 
 class EMA(ExponentialMovingAverage, BaseFeature):
     """
@@ -5,11 +5,11 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
-import numpy as np
+import numpy as np, pandas as pd
 from gateway.driver.data_portal import portal
-from finance.order import Order, PriceOrder, TickerOrder, transfer_to_order
-from finance.transaction import create_transaction
-from util.dt_utilty import locate_pos
+from finance.order import OrderKind, OrderBatch
+from pb.book import BookFields
+from finance.transaction import TransactionBatch, create_transactions
 
 
 class SimulationBlotter(object):
@@ -28,70 +28,121 @@ class SimulationBlotter(object):
     def __init__(self,
                  commission_model,
                  slippage_model,
-                 execution_model):
+                 execution_model,
+                 book=None):
+        """
+            book : IntradayBook , optional --- partial fills by participation of minute volume ,
+            None means every trigger order fills fully
+        """
         self.commission = commission_model
         self.slippage = slippage_model
         self.execution = execution_model
+        self.book = book
+
+    def _trigger_bounds(self, asset, dts):
+        # bottom , upper and slippage of asset on dts --- computed once per asset ; price limit of
+        # asset without restricted change (fund , nan in the price limit table) is unbounded
+        upper = 1 + self.execution.get_limit_ratio(asset, dts)
+        bottom = 1 - self.execution.get_stop_ratio(asset, dts)
+        upper = np.inf if np.isnan(upper) else upper
+        bottom = - np.inf if np.isnan(bottom) else bottom
+        slippage = self.slippage.calculate_slippage_factor(asset, dts)
+        return bottom, upper, slippage
 
-    def _trigger_check(self, order, dts):
+    def match_orders(self, orders, dts, minutes):
         """
-            trigger orders checked by execution_style and slippage_style
+            trigger check on the columns of OrderBatch , orders are grouped by sid and
+            matched on the minutes of asset in one pass
+
+        Parameters
+        ----------
+        orders : OrderBatch
+        dts : str
+        minutes : dict
+            sid : minutes of asset on dts indexed by ticker
+
+        Returns
+        -------
+        trigger_orders : OrderBatch of OrderKind.ORDER , keep the order of orders
         """
-        if order:
-            assert isinstance(order, Order), 'unsolved order type'
-            asset = order.asset
-            price = order.price
-            # 基于订单的设置的上下线过滤订单
-            upper = 1 + self.execution.get_limit_ratio(asset, dts)
-            bottom = 1 - self.execution.get_stop_ratio(asset, dts)
-            # avoid asset price reach price restriction
-            if bottom < price < upper:
-                # 计算滑价系数
-                slippage = self.slippage.calculate_slippage_factor(asset, dts)
-                # print('slippage', self.slippage.basis_points)
-                # print('commission', self.commission.base_cost)
-                order.price = price * (1+slippage)
-                return order
-            return False
-        else:
-            return False
+        prices = orders.price.copy()
+        tickers = orders.ticker.copy()
+        kinds = orders.kind
+        passed = np.zeros(len(orders), dtype=bool)
+        sids, inverse = np.unique(orders.sid, return_inverse=True)
+        for row, sid in enumerate(sids):
+            locs = np.nonzero(inverse == row)[0]
+            close = minutes[sid]['close']
+            values = np.asarray(close.values, dtype=np.float64)
+            index = close.index.values
+            matched = np.ones(len(locs), dtype=bool)
+            price_mask = kinds[locs] == OrderKind.PRICE
+            if price_mask.any():
+                # first ticker which close >= price (locate_pos compares np.sign(amount) with '1' ,
+                # so every PriceOrder is matched on close >= price) --- searchsorted on running max
+                running = np.maximum.accumulate(np.where(np.isnan(values), -np.inf, values)) \
+                    if len(values) else values
+                positions = np.searchsorted(running, prices[locs[price_mask]], side='left')
+                found = positions < len(index)
+                matched[price_mask] = found
+                tickers[locs[price_mask][found]] = index[positions[found]]
+            ticker_mask = kinds[locs] == OrderKind.TICKER
+            if ticker_mask.any():
+                created = tickers[locs[ticker_mask]]
+                rows = close.index.get_indexer(created)
+                if (rows < 0).any():
+                    raise KeyError(pd.Timestamp(created[int(np.argmin(rows))]))
+                prices[locs[ticker_mask]] = values[rows]
+            # trigger check --- bottom < price < upper and slippage
+            bottom, upper, slippage = self._trigger_bounds(orders.assets[sid], dts)
+            hit = matched & (bottom < prices[locs]) & (prices[locs] < upper)
+            prices[locs[hit]] = prices[locs[hit]] * (1 + slippage)
+            passed[locs[hit]] = True
+        data = orders.data.copy()
+        data['price'], data['ticker'], data['kind'] = prices, tickers, OrderKind.ORDER
+        return OrderBatch(data[passed], orders.assets)
 
-    def _validate(self, order, dts):
-        # fulfill the missing attr of PriceOrder and TickerOrder
-        asset = order.asset
-        price = order.price
-        direction = np.sign(order.amount)
-        minutes = portal.get_spot_value(dts, asset, 'minute', ['close'])
-        # print('minutes price', minutes)
-        if isinstance(order, PriceOrder):
-            # print('blotter order', order)
-            ticker = locate_pos(price, minutes['close'], direction)
-            # print('ticker', ticker)
-            new_order = transfer_to_order(order, ticker=ticker)
-        elif isinstance(order, TickerOrder):
-            ticker = order.created_dt
-            # print('minutes', minutes['close'])
-            price = minutes['close'][ticker]
-            # print('ticker price', ticker, price)
-            new_order = transfer_to_order(order, price=price)
-        elif isinstance(order, Order):
-            new_order = order
-        else:
-            raise ValueError
-        trigger_order = self._trigger_check(new_order, dts)
-        # print('trigger_order', trigger_order)
-        return trigger_order
+    def book_orders(self, orders, dts, minutes):
+        """
+            fills of orders simulated by book in one pass , one row per (order , minute) fill
+        """
+        sids = np.unique(orders.sid)
+        bounds, slippage = dict(), np.zeros(len(sids))
+        for loc, sid in enumerate(sids):
+            asset = orders.assets[sid]
+            bottom, upper, slippage[loc] = self._trigger_bounds(asset, dts)
+            bounds[asset] = (bottom, upper)
+        locs, tickers, amounts, prices = self.book.match(orders, dts, minutes, bounds)
+        data = np.empty(len(locs), dtype=orders.data.dtype)
+        data['sid'] = orders.sid[locs]
+        data['price'] = prices * (1 + slippage[sids.searchsorted(data['sid'])])
+        data['amount'] = amounts.astype(np.int64)
+        data['ticker'] = tickers
+        data['kind'] = OrderKind.ORDER
+        return OrderBatch(data, orders.assets)
 
     def create_bulk_transactions(self, orders, dts):
+        """
+            orders : OrderBatch (list of orders is converted) --- TransactionBatch
+        """
+        if not isinstance(orders, OrderBatch):
+            orders = OrderBatch.from_orders(orders)
         try:
-            trigger_orders = [self._validate(order, dts) for order in orders]
-            trigger_orders = [order for order in trigger_orders if order]
+            assets = [orders.assets[sid] for sid in np.unique(orders.sid)]
+            # minutes and pre_close of all assets are read once
+            fields = ['close'] if self.book is None else BookFields
+            minutes = portal.get_spot_values(dts, assets, 'minute', fields)
+            self.execution.get_pre_closes(assets, dts)
+            if self.book is None:
+                trigger_orders = self.match_orders(orders, dts, minutes)
+            else:
+                trigger_orders = self.book_orders(orders, dts, minutes)
             print('trigger_orders', trigger_orders)
             # create txn
-            transactions = [create_transaction(order_obj, self.commission) for order_obj in trigger_orders]
+            transactions = create_transactions(trigger_orders, self.commission)
         except IndexError:
             print('orders either null or can not be triggered')
-            transactions = []
+            transactions = TransactionBatch.empty()
         return transactions
 
 
@@ -0,0 +1,269 @@
+# !/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Tue Mar 12 15:37:47 2019
+
+@author: python
+"""
+import numpy as np, pandas as pd
+from finance.order import OrderKind, OrderBatch
+
+BookFields = ['open', 'close', 'volume']
+# 科创板 --- 临时停牌 30% 60% , 每次10分钟 , 14:57 复盘
+HaltLevels = (0.3, 0.6)
+HaltMinutes = 10
+HaltResume = pd.Timedelta(hours=14, minutes=57)
+# 科创板盘后固定价格交易 15:05 --- 15:30
+AfterHoursTicker = pd.Timedelta(hours=15, minutes=30)
+AfterHoursMinutes = 30
+
+
+def _restricted_change(asset, dts):
+    # None means no price limit (convertible) , nan when the rule of asset is unknown (fund)
+    try:
+        change = asset.restricted_change(dts)
+    except NotImplementedError:
+        return np.nan
+    return np.inf if change is None else change
+
+
+def _fifo_served(arrivals, capacity):
+    """
+        cumulative served amount of FIFO queues (rows) --- Lindley recursion in closed form
+
+        backlog[m] = max(backlog[m-1] + arrivals[m] - capacity[m], 0)
+        --- X = cumsum(arrivals - capacity) , backlog = X - min(0, running min of X)
+    """
+    x = np.cumsum(arrivals - capacity, axis=1)
+    backlog = x - np.minimum(np.minimum.accumulate(x, axis=1), 0)
+    return np.cumsum(arrivals, axis=1) - backlog
+
+
+def _queue_fills(group, arrival, amounts, capacity):
+    """
+    Fills of orders queued by group (asset) in priority order
+
+    Parameters
+    ----------
+    group : np.ndarray[int]
+        queue of each order , orders are sorted by group and priority
+    arrival : np.ndarray[int]
+        minute of each order entering queue , capacity.shape[1] means never
+    amounts : np.ndarray
+        absolute amount of each order
+    capacity : np.ndarray
+        (groups × minutes) amount can be filled on each minute
+
+    Returns
+    -------
+    loc , minute , fill : np.ndarray
+        position of order , minute and amount of each fill
+    """
+    groups, size = capacity.shape
+    queued = arrival < size
+    amounts = np.where(queued, amounts, 0.0)
+    arrivals = np.bincount(group[queued] * size + arrival[queued], weights=amounts[queued],
+                           minlength=groups * size).reshape(groups, size)
+    # served of every queue is shifted by the demand of previous queues , so one searchsorted
+    # on the cumulative demand of all orders locates the orders served on each minute
+    offset = np.concatenate([[0.0], np.cumsum(arrivals.sum(axis=1))[:-1]])[:, None]
+    served = _fifo_served(arrivals, capacity) + offset
+    prev_served = np.concatenate([offset, served[:, :-1]], axis=1)
+    demand = np.cumsum(amounts)
+    prev_demand = demand - amounts
+    rows, minutes = np.nonzero(served > prev_served)
+    lo = np.searchsorted(demand, prev_served[rows, minutes], side='right')
+    hi = np.minimum(np.searchsorted(demand, served[rows, minutes], side='left'), len(amounts) - 1)
+    counts = hi - lo + 1
+    row, minute = np.repeat(rows, counts), np.repeat(minutes, counts)
+    loc = np.repeat(lo, counts) + np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    fill = np.minimum(demand[loc], served[row, minute]) - np.maximum(prev_demand[loc], prev_served[row, minute])
+    valid = fill > 0
+    return loc[valid], minute[valid], fill[valid]
+
+
+class IntradayBook(object):
+    """
+        event-driven intraday order book of one session behind SimulationBlotter
+
+        orders of an asset are queued by time priority (entry minute , then the order of orders)
+        and filled minute by minute with partial fills capped at participation of minute volume
+        (shared by buy and sell orders of the asset) ;
+        remainders carry across minutes . state of the book is numpy arrays --- (assets × minutes)
+        bars and capacity , arrival amount price of orders --- and the queues of all assets are
+        solved in closed form at once instead of iterating minutes
+
+        TickerOrder --- market order entering on created_dt , filled at minute close
+        PriceOrder / Order --- limit order entering when minute close first reaches price
+        (buy close <= price , sell close >= price) , filled at price
+
+        科创板 (bid_mechanism) :
+            前5个交易日(no price limit) 盘中股价较开盘价上涨或下跌幅度首次达到30%、60%时临时停牌10分钟 ,
+            如果跨越14:57则复盘 ; 盘后固定价格交易 --- remainders are filled at close by time priority ,
+            若收盘价高于买入申报指令，则申报无效；若收盘价低于卖出申报指令同样无效
+
+    Parameters
+    ----------
+    participation : float
+        max share of minute volume filled per minute , default 0.1
+    """
+    def __init__(self, participation=0.1):
+        self.participation = participation
+
+    @staticmethod
+    def _bars(assets, minutes):
+        """
+            (assets × minutes) open , close , volume on the union of tickers
+        """
+        frames = [minutes[asset.sid] for asset in assets]
+        tickers = np.unique(np.concatenate([frame.index.values for frame in frames]))
+        bars = np.full((len(BookFields), len(assets), len(tickers)), np.nan)
+        indexers = dict()
+        for row, frame in enumerate(frames):
+            # frames of reader share columns , indexer of columns is computed once
+            columns = tuple(frame.columns)
+            if columns not in indexers:
+                indexers[columns] = [columns.index(field) for field in BookFields]
+            cols = tickers.searchsorted(frame.index.values)
+            bars[:, row, cols] = frame.to_numpy(dtype=np.float64)[:, indexers[columns]].T
+        opens, closes, volumes = bars
+        return pd.DatetimeIndex(tickers), opens, closes, np.nan_to_num(volumes)
+
+    @staticmethod
+    def _halted(assets, dts, tickers, opens, closes):
+        # minutes of 科创板 temporary halts , only apply without price limit
+        halted = np.zeros(closes.shape, dtype=bool)
+        rows = np.array([loc for loc, asset in enumerate(assets)
+                         if asset.bid_mechanism and np.isinf(_restricted_change(asset, dts))], dtype=np.int64)
+        if not len(rows) or not len(tickers):
+            return halted
+        change = closes[rows] / opens[rows, :1] - 1
+        resume = tickers.searchsorted(pd.Timestamp(dts) + HaltResume)
+        minutes = np.arange(len(tickers))[None, :]
+        for level in HaltLevels:
+            for reached in (change >= level, change <= - level):
+                start = np.where(reached.any(axis=1), np.argmax(reached, axis=1) + 1, len(tickers))[:, None]
+                halted[rows] |= (minutes >= start) & (minutes < np.minimum(start + HaltMinutes, resume))
+        return halted
+
+    @staticmethod
+    def _orders(orders):
+        """
+            columns of OrderBatch --- assets , asset row , signed amount , entry ticker
+            (NaT for PriceOrder) and limit price (nan for TickerOrder)
+        """
+        sids, rows = np.unique(orders.sid, return_inverse=True)
+        assets = [orders.assets[sid] for sid in sids]
+        kinds = orders.kind
+        created = np.where(kinds == OrderKind.PRICE, np.datetime64('NaT'), orders.ticker)
+        limits = np.where(kinds == OrderKind.TICKER, np.nan, orders.price)
+        return assets, rows.astype(np.int64), orders.amount.astype(np.float64), created, limits
+
+    @staticmethod
+    def _arrival(created, limits, rows, tickers, closes, sides):
+        """
+            minute of orders entering queue , limit order enters when close first reaches price
+        """
+        size = len(tickers)
+        timed = ~np.isnat(created)
+        arrival = np.zeros(len(created), dtype=np.int64)
+        if timed.any():
+            arrival[timed] = tickers.searchsorted(created[timed])
+        limited = np.nonzero(~np.isnan(limits))[0]
+        if len(limited):
+            # first minute >= entry which close reaches price
+            # buy close <= price , sell close >= price --- (close - price) * side <= 0
+            side = sides[limited, None]
+            reached = closes[rows[limited]] * side <= limits[limited, None] * side
+            reached &= np.arange(size)[None, :] >= arrival[limited, None]
+            first = np.argmax(reached, axis=1)
+            arrival[limited] = np.where(reached[np.arange(len(limited)), first], first, size)
+        return arrival
+
+    def _after_hours(self, assets, rows, volumes, closes, remains, arrival, limits, sides, bottom, upper):
+        """
+            科创板盘后固定价格交易 --- remainders fill at close by time priority , capped at
+            participation of average minute volume over the session ; the band of match applies ,
+            order whose limit price or close is out of (bottom , upper) is not filled
+        """
+        fills = np.zeros(len(remains))
+        star = np.array([asset.bid_mechanism for asset in assets], dtype=bool)
+        if not star.any() or not closes.shape[1]:
+            return fills
+        close = closes[:, -1]
+        ticks = np.array([asset.tick_size for asset in assets], dtype=np.float64)
+        capacity = np.floor(self.participation * volumes.mean(axis=1) * AfterHoursMinutes / ticks) * ticks
+        capacity[~star] = 0
+        order_close = close[rows]
+        band = (bottom[rows] < order_close) & (order_close < upper[rows]) & \
+            (np.isnan(limits) | ((bottom[rows] < limits) & (limits < upper[rows])))
+        valid = band & (np.isnan(limits) | np.where(sides > 0, order_close <= limits, order_close >= limits))
+        priority = np.lexsort((np.arange(len(remains)), arrival, rows))
+        demand = np.where(valid, remains, 0.0)[priority]
+        group = rows[priority]
+        # cumulative demand of the asset before and after each order
+        total = np.cumsum(demand)
+        offset = np.concatenate([[0.0], np.cumsum(np.bincount(group, weights=demand, minlength=len(assets)))[:-1]])
+        after = total - offset[group]
+        cap = capacity[group]
+        fills[priority] = np.maximum(np.minimum(after, cap) - np.minimum(after - demand, cap), 0)
+        return fills
+
+    def match(self, orders, dts, minutes, bounds=None):
+        """
+        Parameters
+        ----------
+        orders : OrderBatch (list of Order / PriceOrder / TickerOrder is converted)
+        dts : str '%Y-%m-%d'
+        minutes : dict
+            sid : open , close , volume of asset on dts indexed by ticker
+        bounds : dict , optional
+            asset : (bottom , upper) band of fill price (SimulationBlotter._trigger_bounds)
+
+        Returns
+        -------
+        loc , ticker , amount , price : np.ndarray
+            position in orders , ticker (datetime64) , signed amount and price of each fill ,
+            sorted by ticker and loc
+        """
+        empty = np.array([], dtype=np.int64), np.array([], dtype='datetime64[ns]'), np.array([]), np.array([])
+        if not isinstance(orders, OrderBatch):
+            orders = OrderBatch.from_orders(orders)
+        if not len(orders):
+            return empty
+        assets, rows, amounts, created, limits = self._orders(orders)
+        tickers, opens, closes, volumes = self._bars(assets, minutes)
+        bounds = bounds or dict()
+        bottom, upper = np.array([bounds.get(asset, (-np.inf, np.inf)) for asset in assets], dtype=np.float64).T
+        # capacity --- participation of minute volume (lots of tick_size) , zero when halted or out of band
+        ticks = np.array([asset.tick_size for asset in assets], dtype=np.float64)[:, None]
+        capacity = np.floor(self.participation * volumes / ticks) * ticks
+        tradable = ~self._halted(assets, dts, tickers, opens, closes) & \
+            (bottom[:, None] < closes) & (closes < upper[:, None])
+        capacity = np.where(tradable, capacity, 0.0)
+
+        sides = np.sign(amounts)
+        amounts = np.abs(amounts)
+        arrival = self._arrival(created, limits, rows, tickers, closes, sides)
+        # limit price out of band is never triggered
+        arrival[~np.isnan(limits) & ~((bottom[rows] < limits) & (limits < upper[rows]))] = len(tickers)
+        # buy and sell orders of an asset share one queue by time priority , so the fills of a minute
+        # never exceed participation of minute volume whatever the side
+        priority = np.lexsort((np.arange(len(orders)), arrival, rows))
+        loc, minute, fill = _queue_fills(rows[priority], arrival[priority], amounts[priority], capacity)
+        loc = priority[loc]
+        price = np.where(np.isnan(limits[loc]), closes[rows[loc], minute], limits[loc])
+        filled = np.bincount(loc, weights=fill, minlength=len(orders))
+        fills = [(loc, tickers.values[minute], fill * sides[loc], price)]
+        after = self._after_hours(assets, rows, volumes, closes, amounts - filled, arrival, limits, sides,
+                                 bottom, upper)
+        if after.any():
+            loc = np.nonzero(after)[0]
+            ticker = np.full(len(loc), (pd.Timestamp(dts) + AfterHoursTicker).to_datetime64())
+            fills.append((loc, ticker, after[loc] * sides[loc], closes[rows[loc], -1]))
+        loc, ticker, amount, price = [np.concatenate(arrays) for arrays in zip(*fills)]
+        order = np.lexsort((loc, ticker))
+        return loc[order], ticker[order], amount[order], price[order]
+
+
+__all__ = ['IntradayBook', 'BookFields']
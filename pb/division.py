@@ -7,7 +7,7 @@ Created on Tue Mar 12 15:37:47 2019
 """
 import numpy as np, copy
 from gateway.driver.data_portal import portal
-from finance.order import PriceOrder, TickerOrder
+from finance.order import OrderBatch
 from finance.control import UnionControl
 
 
@@ -23,8 +23,14 @@ class Division(object):
 
     def _calculate_division_data(self, asset, dts, amount_only=False):
         tick_size = asset.tick_size
-        open_change, pre_close = portal.get_open_pct(asset, dts)
-        ensure_price = pre_close * (1 + asset.restricted_change(dts))
+        # limit_up --- pre_close * (1 + restricted_change) from the session price limit table
+        open_change, pre_close, ensure_price = \
+            portal.get_price_limits([asset], dts).iloc[0][['open_pct', 'pre_close', 'limit_up']]
+        if not np.isfinite(ensure_price):
+            # no price limit (convertible , 科创板 first days) or unknown rule (fund) --- size on pre_close
+            print('%s has no finite limit_up on %s , ensure price falls back to pre_close' % (asset.sid, dts))
+            ensure_price = pre_close
+        assert np.isfinite(ensure_price), 'pre_close of %s on %s is missing' % (asset.sid, dts)
         # ensure amount at least 1 , base_amount(单位股数）
         # base_amount = max(tick_size, np.ceil(self.base_capital / ensure_price))
         base_amount = tick_size if tick_size * ensure_price >= self.base_capital else \
@@ -55,7 +61,11 @@ class Division(object):
         # else:
         #     orders = [PriceOrder(asset, *z) for z in zips]
         # print('orders', orders)
-        orders = [TickerOrder(asset, *z) for z in zips]
+        zips = list(zips)
+        if not zips:
+            return OrderBatch.empty()
+        amounts, tickers = zip(*zips)
+        orders = OrderBatch.from_arrays(asset, np.asarray(amounts, dtype=np.int64), tickers)
         return orders
 
     def divided_by_capital(self, asset, capital, portfolio, dts):
@@ -92,7 +102,7 @@ class Division(object):
             capital_orders = self._simulate_iterator(asset, zip_iterables)
             # print('capital_orders', capital_orders)
         else:
-            capital_orders = []
+            capital_orders = OrderBatch.empty()
         return capital_orders
 
     def divided_by_position(self, position, portfolio, dts):
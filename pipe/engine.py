@@ -5,13 +5,23 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
-from toolz import keyfilter
+from toolz import keyfilter, valfilter, groupby
 from functools import partial
 from itertools import chain
+from concurrent.futures import ThreadPoolExecutor
 from abc import ABC, abstractmethod
+from _calendar.trading_calendar import calendar
+from collections import OrderedDict
 from pipe.loader.loader import PricingLoader
-from finance.restrictions import UnionRestrictions
+from pipe.pipeline import Pipeline
+from pipe.term import Term, SignalPanel
+from finance.restrictions import UnionRestrictions, RestrictionMasks
 from gateway.asset.finder import asset_finder
+from gateway.driver.data_portal import portal
+from util.cache import ResultMemo
+
+# sessions of restriction masks computed in one pass when end_session is not given
+UniverseBlock = 252
 
 
 class Engine(ABC):
@@ -31,13 +41,35 @@ class Engine(ABC):
         _get_loader = PricingLoader(engine_terms)
         return pipelines, _get_loader
 
-    def _calculate_universe(self, dts):
+    def _universe_sessions(self, dts):
+        # sessions from dts to end_session (include) or a block of UniverseBlock sessions
+        all_sessions = calendar.all_sessions
+        start = all_sessions.searchsorted(dts)
+        if self.end_session:
+            end = all_sessions.searchsorted(self.end_session, side='right')
+        else:
+            end = start + UniverseBlock
+        sessions = list(all_sessions[start:max(end, start + 1)])
+        return sessions
+
+    def _calculate_masks(self, dts):
+        """
+            restriction masks of default assets over the sessions from dts , computed in bulk
+        """
         # default assets
         asset_finder.synchronize()
         # equities = asset_finder.retrieve_type_assets('equity')
         equities = list(asset_finder.retrieve_type_assets('equity'))[:10]
         # print('pipeline restricted_rules', self.restricted_rules.sub_restrictions)
-        default_mask = self.restricted_rules.is_restricted(equities, dts)
+        sessions = self._universe_sessions(dts)
+        masks = RestrictionMasks(self.restricted_rules, equities, sessions)
+        return masks
+
+    def _calculate_universe(self, dts):
+        # lazy --- masks are computed once for the range and looked up session by session
+        if self._universe_masks is None or not self._universe_masks.covers(dts):
+            self._universe_masks = self._calculate_masks(dts)
+        default_mask = self._universe_masks.lookup(dts)
         return default_mask
 
     def _initialize_metadata(self, ledger, dts):
@@ -51,7 +83,6 @@ class Engine(ABC):
         metadata = self._get_loader.load_pipeline_arrays(dts, mask, 'daily')
         # print('engine metadata sids', set(metadata))
         # 过滤没有数据的sid
-        from toolz import valfilter
         metadata = valfilter(lambda x: not x.empty, metadata)
         # print('metadata symbols', set(metadata))
         # mask = [m for m in mask if m.sid in set(metadata) and not metadata[m.sid].empty]
@@ -59,6 +90,47 @@ class Engine(ABC):
         # print('engine mask', engine_mask)
         return metadata, engine_mask
 
+    def _chunk_sessions(self, dts):
+        # sessions of the chunk which starts at dts
+        end_session = self.end_session or calendar.all_sessions[-1]
+        chunks = calendar.compute_range_chunks(dts, end_session, self.chunksize)
+        start, end = next(chunks, (dts, dts))
+        sessions = list(calendar.session_in_range(start, end)) + [end]
+        return sessions
+
+    def _initialize_chunk(self, ledger, dts):
+        """
+            metadata and pipeline outputs of every session in the chunk which starts at dts ,
+            kline of the union of universes is loaded and adjusted once for the whole chunk ;
+            terms are computed on the window of each session (not over a dates × sids block)
+        """
+        sessions = self._chunk_sessions(dts)
+        universes = {session: self._calculate_universe(session) for session in sessions}
+        assets = set(chain(*universes.values())) | set(ledger.positions)
+        self._chunk_cache = dict()
+        for session, metadata in self._get_loader.load_pipeline_chunk(sessions, assets, 'daily'):
+            metadata = valfilter(lambda x: not x.empty, metadata)
+            mask = set([symbol for symbol in universes[session] if symbol.sid in metadata])
+            pipes, scores = self.run_pipeline(metadata, list(mask), session)
+            self._chunk_cache[session] = (metadata, mask, pipes, scores)
+
+    def _lookup_chunk(self, ledger, dts):
+        """
+            pipeline outputs of dts computed by chunk ; positions out of universe take part
+            in pipelines as well , rerun pipelines of dts in that case
+        """
+        if dts not in self._chunk_cache:
+            self._initialize_chunk(ledger, dts)
+        metadata, mask, pipes, scores = self._chunk_cache.pop(dts)
+        extra = set(ledger.positions) - mask
+        if extra:
+            if all(symbol.sid in metadata for symbol in extra):
+                pipes, scores = self.run_pipeline(metadata, list(mask | extra), dts)
+            else:
+                metadata, default_mask = self._initialize_metadata(ledger, dts)
+                pipes, scores = self.run_pipeline(metadata, default_mask, dts)
+        return metadata, pipes, scores
+
     def _split_positions(self, ledger, dts):
         """
         Register a Pipeline default for pipe on every day.
@@ -91,81 +163,170 @@ class Engine(ABC):
         # print('traded_positions', traded_positions)
         return traded_positions, remove_positions
 
-    def _run_pipeline(self, pipeline, metadata, mask):
+    def _ensure_executor(self):
+        # thread pool of independent terms
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers)
+        return self._executor
+
+    def close(self):
+        """
+            shut down the thread pool of terms , recreated lazily by the next run
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _ensure_shared_pipeline(self):
+        """
+            all pipelines merged into one graph , term identity is deduplicated by Term._term_cache
+            so the term shared by pipelines is one node ; rebuilt when terms of pipelines change
+        """
+        terms = tuple(OrderedDict.fromkeys(chain(*[pipeline.terms for pipeline in self.pipelines])))
+        if self._shared_pipeline is None or self._shared_pipeline.terms != list(terms):
+            self._shared_pipeline = Pipeline(list(terms))
+        return self._shared_pipeline
+
+    def _run_pipeline(self, pipeline, metadata, mask, workspace=None):
         """
         ----------
         pipe : zipline.pipe.Pipeline
             The pipe to run.
         """
-        out = pipeline.to_execution_plan(metadata, mask, self.final)
+        out = pipeline.to_execution_plan(metadata, mask, self.final, workspace=workspace)
         return out
 
-    def run_pipeline(self, pipeline_metadata, mask):
+    def _signal_panel(self, metadata):
+        """
+            SignalPanel of the session shared by pipelines and ump , only the panel of the
+            latest metadata is kept
+        """
+        cached, panel = self._session_panel
+        if cached is not metadata:
+            panel = SignalPanel(metadata)
+            self._session_panel = (metadata, panel)
+        return panel
+
+    def _compute_pipelines(self, pipeline_metadata, mask):
+        # each unique term of all pipelines is computed once , pipelines lookup the outputs
+        executor = self._ensure_executor() if self.workers > 1 else None
+        shared = self._ensure_shared_pipeline()
+        panel = self._signal_panel(pipeline_metadata) if any(term.vectorized for term in shared.plan.terms) else None
+        workspace, scores = shared.compute_workspace(pipeline_metadata, mask, executor, panel)
+        _partial_func = partial(self._run_pipeline,
+                                mask=mask,
+                                metadata=pipeline_metadata,
+                                workspace=workspace)
+        results = [_partial_func(pipeline) for pipeline in self.pipelines]
+        results = [r for r in results if r]
+        # print('run pipeline output', results)
+        return results, scores
+
+    def _memo_parts(self, name, sids):
+        # key of memo --- sids , pipelines (term fingerprint) , final model , loader windows and
+        # strategy sources
+        final = sorted(getattr(self.final, '__dict__', {}).items())
+        loader = (tuple(sorted(self._get_loader.field_windows.items())), self._get_loader.extension)
+        return (name, tuple(sorted(sids)), tuple(pipeline.fingerprint for pipeline in self.pipelines),
+                type(self.final).__name__, repr(final), loader, Term.registry.source_digest())
+
+    def run_pipeline(self, pipeline_metadata, mask, dts=None):
         """
         Compute values for  pipelines on a specific date.
         Parameters
         ----------
         pipeline_metadata : cache data for pipe
         mask : default asset list
+        dts : str , optional
+            session of metadata , outputs are memoized on disk by session when memo is enabled
         ----------
-        return --- assets which tag by pipeline name
+        return --- assets which tag by pipeline name , scores (term : dict sid : score)
         """
-        _partial_func = partial(self._run_pipeline,
-                                mask=mask,
-                                metadata=pipeline_metadata)
-
-        results = []
-        for pipeline in self.pipelines:
-            out = _partial_func(pipeline)
-            # print('out', out)
-            results.append(out)
-        results = [r for r in results if r]
-        # print('run pipeline output', results)
-        return results
+        if self._memo is None or dts is None:
+            return self._compute_pipelines(pipeline_metadata, mask)
+        parts = self._memo_parts('pipeline', [symbol.sid for symbol in mask])
+        index = {pipeline.name: loc for loc, pipeline in enumerate(self.pipelines)}
+        terms = {term.fingerprint: term for term in self._ensure_shared_pipeline().terms}
+        try:
+            outputs, memo_scores = self._memo.get('pipeline', dts, parts)
+        except KeyError:
+            results, scores = self._compute_pipelines(pipeline_metadata, mask)
+            outputs = [(index[r.tag], r.sid) for r in results]
+            memo_scores = {term.fingerprint: score for term, score in scores.items()}
+            self._memo.set('pipeline', dts, parts, (outputs, memo_scores))
+            return results, scores
+        # replay --- tag assets of mask by the name of pipeline in this run
+        proxy = {symbol.sid: symbol for symbol in mask}
+        results = [proxy[sid].source_id(self.pipelines[loc].name) for loc, sid in outputs]
+        scores = {terms[key]: score for key, score in memo_scores.items() if key in terms}
+        return results, scores
 
     @staticmethod
-    def _run_ump(pipeline, position, metadata):
+    def _run_ump(pipeline, position, metadata, scores=None):
         # print('ump_picker', pipeline.ump_terms)
         # output --- bool or position
-        result = pipeline.to_withdraw_plan(position, metadata)
+        result = pipeline.to_withdraw_plan(position, metadata, scores)
         return result
 
-    def run_ump(self, metadata, positions):
-        """
-            umps --- based on different asset type --- (symbols , etf , bond)
-                    to determine withdraw strategy
-            return position list
-        """
+    def _compute_ump(self, metadata, positions, scores=None):
         output = []
         if positions:
             # print('ump positions', positions)
-            _ump_func = partial(self._run_ump, metadata=metadata)
-            # proxy -- positions : pipeline
-            proxy_position = {p.asset.tag: p for p in positions}
+            # proxy -- pipeline name : positions
+            proxy_position = groupby(lambda p: p.asset.tag, positions)
             # print('proxy_position', proxy_position)
             proxy_pipeline = {pipe.name: pipe for pipe in self.pipelines}
             # print('proxy_pipeline', proxy_pipeline)
-            for proxy in proxy_position:
-                res = _ump_func(
-                    proxy_pipeline[proxy],
-                    proxy_position[proxy]
-                )
-                output.append(res)
-            # ump position
-            output = [r for r in output if r]
+            vectorized = any(picker.vectorized for proxy in proxy_position
+                             for picker in proxy_pipeline[proxy].ump_terms)
+            panel = self._signal_panel(metadata) if vectorized else None
+            for proxy, grp in proxy_position.items():
+                output.extend(proxy_pipeline[proxy].to_withdraw_batch(grp, metadata, scores, panel))
         # print('run ump result', output)
         return output
 
+    def run_ump(self, metadata, positions, scores=None, dts=None):
+        """
+            umps --- based on different asset type --- (symbols , etf , bond)
+                    to determine withdraw strategy
+            scores --- term : dict sid : score of pipelines , picker reuses the score of term
+            positions of one pipeline are evaluated in one batch , result is memoized on disk
+            by session (dts) when memo is enabled
+            return position list
+        """
+        if self._memo is None or dts is None or not positions:
+            return self._compute_ump(metadata, positions, scores)
+        index = {pipeline.name: loc for loc, pipeline in enumerate(self.pipelines)}
+        proxy = {(index[p.asset.tag], p.asset.sid): p for p in positions}
+        parts = self._memo_parts('ump', proxy)
+        try:
+            withdraw = self._memo.get('ump', dts, parts)
+        except KeyError:
+            output = self._compute_ump(metadata, positions, scores)
+            self._memo.set('ump', dts, parts, [(index[p.asset.tag], p.asset.sid) for p in output])
+            return output
+        return [proxy[key] for key in withdraw]
+
     def execute_algorithm(self, ledger, dts):
         """
             calculate pipelines and ump
         """
-        metadata, default_mask = self._initialize_metadata(ledger, dts)
+        if self.chunksize:
+            # 执行算法逻辑 --- lookup outputs of chunk
+            metadata, pipes, scores = self._lookup_chunk(ledger, dts)
+        else:
+            metadata, default_mask = self._initialize_metadata(ledger, dts)
+            # 执行算法逻辑
+            pipes, scores = self.run_pipeline(metadata, default_mask, dts)
         traded_positions, removed_positions = self._split_positions(ledger, dts)
-        # 执行算法逻辑
-        pipes = self.run_pipeline(metadata, default_mask)
         # 剔除righted positions, violate_positions, expired_positions
-        ump_positions = self.run_ump(metadata, traded_positions)
+        ump_positions = self.run_ump(metadata, traded_positions, scores, dts)
         ump_positions = set(ump_positions) | removed_positions
         # print('ump_positions', ump_positions)
         # yield self.resolve_conflicts(pipes, ump_positions, ledger.positions)
@@ -239,6 +400,19 @@ class SimplePipelineEngine(Engine):
         _get_loader : PricingLoader
         ump_picker : strategy for putting positions
         max_holding_num : defined by the num of pipelines
+        chunksize : int , optional
+            prepare metadata of chunksize sessions in one pass (kline read and 前复权 once per
+            chunk) , pipelines still run session by session on the window of each session and
+            outputs are looked up by session ; None means session by session
+        end_session : str , optional
+            the last session of chunks , default the last session of calendar
+        workers : int , optional
+            threads running independent terms of one layer of the merged graph of pipelines ,
+            default 1 (serial) ; the pool is shut down by close (or leaving ``with engine``)
+        memo : str , optional
+            directory of on-disk memo of run_pipeline and run_ump by session , keyed by
+            Term.fingerprint of pipelines and DataPortal.data_version ; reruns which only change
+            broker , allocation or metrics replay the memoized signals . None means disabled
     """
     __slots__ = [
         'disallowed_righted',
@@ -251,12 +425,25 @@ class SimplePipelineEngine(Engine):
                  final_model,
                  restrictions,
                  disallow_righted=True,
-                 disallow_violation=True):
+                 disallow_violation=True,
+                 chunksize=None,
+                 end_session=None,
+                 workers=1,
+                 memo=None):
         self.disallowed_righted = disallow_righted
         self.disallowed_violation = disallow_violation
         self.restricted_rules = UnionRestrictions(restrictions)
         self.final = final_model
         self.pipelines, self._get_loader = self._init_loader(pipelines)
+        self.chunksize = chunksize
+        self.end_session = end_session
+        self._chunk_cache = dict()
+        self._universe_masks = None
+        self.workers = workers or 1
+        self._executor = None
+        self._shared_pipeline = None
+        self._session_panel = (None, None)
+        self._memo = ResultMemo(memo, portal.data_version) if memo else None
 
     @staticmethod
     def resolve_conflicts(calls, puts, holdings):
@@ -7,10 +7,42 @@ Created on Tue Mar 12 15:37:47 2019
 """
 import uuid, networkx as nx, numpy as np
 import matplotlib.pyplot as plt
+from itertools import chain
 from toolz import valfilter
 from pipe.term import NotSpecific, Term
 
 
+class ExecutionPlan(object):
+    """
+        immutable layered plan compiled from TermGraph
+
+        terms of one layer are independent and their dependencies are all in the previous
+        layers , layers are ordered the same as decref_dependencies of TermGraph
+
+    Parameters
+    ----------
+    layers : list of list of Term
+    """
+    __slots__ = ['layers', 'terms', 'dependencies']
+
+    def __init__(self, layers):
+        self.layers = tuple(tuple(layer) for layer in layers)
+        self.terms = tuple(chain(*self.layers))
+        loc = {term: idx for idx, term in enumerate(self.terms)}
+        # dependency indices of terms (ascending , the order of outputs in workspace)
+        self.dependencies = tuple(tuple(sorted(loc[dependency] for dependency in term.dependencies
+                                               if dependency != NotSpecific)) for term in self.terms)
+
+    def __iter__(self):
+        return iter(self.layers)
+
+    def __len__(self):
+        return len(self.layers)
+
+    def __repr__(self):
+        return 'ExecutionPlan(%r)' % (self.layers,)
+
+
 class TermGraph(object):
     """
     An abstract representation of Pipeline Term dependencies.
@@ -96,6 +128,19 @@ class TermGraph(object):
             self.graph.remove_node(node)
         return nodes
 
+    def compile(self):
+        """
+        Compile graph into ExecutionPlan without mutating graph
+        """
+        graph = self.graph.copy()
+        layers = []
+        while len(graph):
+            refcounts = dict(graph.in_degree())
+            nodes = list(valfilter(lambda x: x == 0, refcounts))
+            graph.remove_nodes_from(nodes)
+            layers.append(nodes)
+        return ExecutionPlan(layers)
+
     def draw(self):
         # plt.subplot(121)
         # nx.draw(self.graph)
@@ -107,7 +152,7 @@ class TermGraph(object):
         plt.show()
 
 
-__all__ = ['TermGraph']
+__all__ = ['TermGraph', 'ExecutionPlan']
 
 
 if __name__ == '__main__':
@@ -122,5 +167,6 @@ if __name__ == '__main__':
     print('ordered graph', list(graph.ordered()))
     print('nodes', graph.nodes)
     print('length', len(graph))
+    print('plan', graph.compile())
     # graph.decref_dependencies()
     graph.draw()
@@ -5,6 +5,7 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
+import numpy as np
 from pipe.loader.base import PipelineLoader
 from _calendar.trading_calendar import calendar
 from pipe.loader import EVENT
@@ -13,21 +14,79 @@ from gateway.driver.data_portal import portal
 
 class PricingLoader(PipelineLoader):
 
-    def __init__(self, terms, multiplier=3):
+    def __init__(self, terms, extension=8):
         """
             A pipe for loading daily adjusted qfq reality OHLCV data.
             terms --- pipe terms and ump terms
+            extension --- warm-up is counted in traded bars , the calendar window of a sid suspended
+                          inside it is doubled until the sid has warm-up bars , at most extension
+                          times of the warm-up (sid listed recently has not enough bars at all)
         """
         domains = [term.domain for term in terms]
         self.pipeline_domain = self._resolve_domains(domains)
-        self.scale = multiplier
+        self.field_windows = self._plan_windows(terms)
+        self.extension = extension
+
+    @staticmethod
+    def _plan_windows(terms):
+        """
+            field : the largest warm-up of terms which need the field
+        """
+        field_windows = dict()
+        for term in terms:
+            for field in term.domain.domain_field:
+                field_windows[field] = max(field_windows.get(field, 0), abs(term.warmup))
+        return field_windows
+
+    @property
+    def window(self):
+        # history window (negative) covering every field , window -1 is restricted to spot value
+        window = max(self.field_windows.values()) if self.field_windows else 1
+        return - max(window, 2)
+
+    def _complete(self, kline, dts, assets, data_frequency):
+        """
+            sid with fewer bars than warm-up (suspended sessions inside window) is refetched with
+            a doubled window until it has warm-up bars or the window reaches the extension ; sid
+            whose bars are not increased by the extension (listed recently) is left as it is
+        """
+        bars, window = - self.window, self.window
+        fields = list(self.field_windows)
+        short = [asset for asset in assets if 0 < len(kline.get(asset.sid, ())) < bars]
+        while short and abs(window) < self.extension * bars:
+            window = window * 2
+            extended = portal.get_history_window(short, dts, window, fields, data_frequency)
+            grown = [asset for asset in short if len(extended.get(asset.sid, ())) > len(kline[asset.sid])]
+            kline.update(extended)
+            short = [asset for asset in grown if len(kline[asset.sid]) < bars]
+        return kline
+
+    def _trim(self, kline):
+        """
+            frame of sid is restricted to the last warm-up bars and each field to its own planned
+            warm-up , the head of field which needs fewer bars is nan
+        """
+        bars = - self.window
+        trimmed = dict()
+        for sid, frame in kline.items():
+            frame = frame.iloc[-bars:].copy()
+            for field, window in self.field_windows.items():
+                head = len(frame) - max(window, 1)
+                if head > 0:
+                    frame.iloc[:head, frame.columns.get_loc(field)] = np.nan
+            trimmed[sid] = frame
+        return trimmed
 
     def load_pipeline_arrays(self, dts, assets, data_frequency):
+        """
+            fields of terms are fetched once with the largest window that field needs ,
+            kline reader retrieves OHLCV of a window in one read , so fields share one fetch
+        """
         # print('dts', dts)
         # print('assets', assets)
-        fields = list(self.pipeline_domain.domain_field)
+        fields = list(self.field_windows)
         # print('loader fields', fields)
-        window = - self.scale * abs(self.pipeline_domain.domain_window)
+        window = self.window
         # print('loader window', window)
         adjust_kline = portal.get_history_window(assets,
                                                  dts,
@@ -35,8 +94,24 @@ class PricingLoader(PipelineLoader):
                                                  fields,
                                                  data_frequency
                                                  )
+        adjust_kline = self._complete(dict(adjust_kline), dts, assets, data_frequency)
         # print('adjust_kline', set(adjust_kline))
-        return adjust_kline
+        return self._trim(adjust_kline)
+
+    def load_pipeline_chunk(self, sessions, assets, data_frequency):
+        """
+            metadata of every session in chunk , kline of chunk is loaded once
+            :return: generator of (session , metadata)
+        """
+        fields = list(self.field_windows)
+        chunk = portal.get_history_chunk(assets,
+                                         sessions,
+                                         self.window,
+                                         fields,
+                                         data_frequency)
+        for session, kline in chunk:
+            kline = self._complete(dict(kline), session, assets, data_frequency)
+            yield session, self._trim(kline)
 
 
 class EventLoader(PipelineLoader):
@@ -7,9 +7,8 @@ Created on Tue Mar 12 15:37:47 2019
 """
 import uuid
 from collections import OrderedDict
-from toolz import keyfilter
 from functools import reduce
-from pipe.term import Term, NotSpecific
+from pipe.term import Term, SignalPanel
 from pipe.graph import TermGraph
 from pipe.ump import UmpPickers
 
@@ -21,13 +20,15 @@ class Pipeline(object):
         b. withdraw logic of pipe --- instance of ump_picker
         c. pipe --- ump_picker
     """
-    __slots__ = ['_terms_store', '_name', '_workspace', '_ump']
+    __slots__ = ['_terms_store', '_name', '_workspace', '_ump', '_plan', '_scores']
 
     def __init__(self, terms, ump_picker=None):
         self._terms_store = [terms] if isinstance(terms, Term) else terms
         self._workspace = OrderedDict()
+        self._scores = dict()
         self._ump = UmpPickers(ump_picker) if ump_picker else UmpPickers(terms)
         self._name = str(uuid.uuid4())
+        self._plan = None
 
     @property
     def name(self):
@@ -56,6 +57,23 @@ class Pipeline(object):
         graph = TermGraph(self._terms_store)
         return graph
 
+    @property
+    def fingerprint(self):
+        """
+            terms and ump pickers of pipe by Term.fingerprint , name is random per run
+        """
+        return tuple(term.fingerprint for term in self._terms_store), \
+            tuple(picker.fingerprint for picker in self._ump.pickers)
+
+    @property
+    def plan(self):
+        """
+            ExecutionPlan compiled once from TermGraph , recompiled after terms change
+        """
+        if self._plan is None:
+            self._plan = self._init_graph().compile()
+        return self._plan
+
     def __add__(self, term):
         if not isinstance(term, Term):
             raise TypeError(
@@ -66,6 +84,7 @@ class Pipeline(object):
         # if term in self._graph.nodes:
         #     raise Exception('term object already exists in pipe')
         self._terms_store.append(term)
+        self._plan = None
         return self
 
     def __sub__(self, term):
@@ -73,57 +92,92 @@ class Pipeline(object):
             self._terms_store.remove(term)
         except Exception as e:
             raise TypeError(e)
+        self._plan = None
         return self
 
-    def _combine_term_dependence(self, term, default_mask):
-        # print('dependence', term.dependencies)
-        if term.dependencies != [NotSpecific]:
-            # 将节点的依赖筛选出来
-            dependence_masks = keyfilter(lambda x: x in term.dependencies,
-                                         self._workspace)
-            # print('dependence_masks', dependence_masks)
+    def _combine_term_dependence(self, inputs, default_mask):
+        """
+            inputs --- dependencies of term resolved by ExecutionPlan.dependencies , the intersection
+            of their outputs is the input mask of term
+        """
+        if inputs:
             # 将依赖的交集作为节点的input
             input_mask = reduce(lambda x, y: set(x) & set(y),
-                                dependence_masks.values())
+                                [self._workspace[dependency] for dependency in inputs])
         else:
             input_mask = default_mask
         return input_mask
 
-    def _decref_recursive(self, graph, metadata, mask):
+    def _compute_node(self, node, inputs, metadata, mask, panel, scores):
+        node_mask = self._combine_term_dependence(inputs, mask)
+        # print('node_mask', node_mask)
+        if node.vectorized:
+            output = node.compute_panel(panel, list(node_mask), scores)
+        else:
+            output = node.compute(metadata, list(node_mask), scores)
+        return output
+
+    def _compute_layer(self, plan, locs, metadata, mask, panel, executor):
         """
-            internal method for decref_recursive
-            decrease by layer
+            terms of one layer (locs of plan) are independent and run on executor when it is given ,
+            outputs are merged into _workspace in the order of layer
         """
-        # print('decref graph', graph.nodes)
-        decref_nodes = graph.decref_dependencies()
-        # print('decref nodes', decref_nodes)
-        if decref_nodes:
-            for node in decref_nodes:
-                node_mask = self._combine_term_dependence(node, mask)
-                # print('node_mask', node_mask)
-                output = node.compute(metadata, list(node_mask))
-                self._workspace[node] = output
-                # print('_workspace', self._workspace)
-            self._decref_recursive(graph, metadata, mask)
+        layer = [plan.terms[loc] for loc in locs]
+        inputs = [[plan.terms[dep] for dep in plan.dependencies[loc]] for loc in locs]
+        # sid : score of each node
+        scores = [self._scores.setdefault(node, dict()) for node in layer]
+        if executor is not None and len(layer) > 1:
+            futures = [executor.submit(self._compute_node, node, deps, metadata, mask, panel, score)
+                       for node, deps, score in zip(layer, inputs, scores)]
+            outputs = [future.result() for future in futures]
+        else:
+            outputs = [self._compute_node(node, deps, metadata, mask, panel, score)
+                       for node, deps, score in zip(layer, inputs, scores)]
+        for node, output in zip(layer, outputs):
+            self._workspace[node] = output
+            # print('_workspace', self._workspace)
 
-    def _decref_dependence(self, graph, metadata, mask):
+    def _decref_dependence(self, plan, metadata, mask, executor=None, panel=None):
         """
-        Return a topologically-sorted list of the terms in ``self`` which
-        need to be computed.
-
-        Filters out any terms that are already present in ``workspace``, as
-        well as any terms with refcounts of 0.
+        Run the layers of ExecutionPlan in order ; term which implements _run_signal_panel
+        is computed on the SignalPanel of metadata (built once) , otherwise sid by sid
 
         Parameters
         ----------
+        plan : ExecutionPlan
+            layers of terms compiled from TermGraph
         metadata : dict[Term, np.ndarray]
             Initial state of workspace for a pipe execution. May contain
             pre-computed values provided by ``populate_initial_workspace``.
         mask : asset list
             Reference counts for terms to be computed. Terms with reference
             counts of 0 do not need to be computed.
+        executor : concurrent.futures.Executor , optional
+            run independent terms of one layer in parallel
+        panel : SignalPanel , optional
+            panel of metadata kept by engine for the session , built here when it is not given
+        """
+        if panel is None and any(term.vectorized for term in plan.terms):
+            panel = SignalPanel(metadata)
+        start = 0
+        for layer in plan:
+            self._compute_layer(plan, range(start, start + len(layer)), metadata, mask, panel, executor)
+            start += len(layer)
+
+    def compute_workspace(self, metadata, mask, executor=None, panel=None):
+        """
+            outputs and scores of all terms , used by engine to compute the terms shared
+            by pipelines once
+
+        Returns
+        -------
+        workspace : OrderedDict term : output
+        scores : dict term : dict sid : score
         """
-        self._decref_recursive(graph, metadata, mask)
+        self._decref_dependence(self.plan, metadata, mask, executor, panel)
+        workspace, scores = self._workspace, self._scores
+        self._workspace, self._scores = OrderedDict(), dict()
+        return workspace, scores
 
     def compute_eager_pipeline(self, final):
         """
@@ -140,21 +194,32 @@ class Pipeline(object):
             final_out = None
         return final_out
 
-    def to_execution_plan(self, metadata, mask, final):
+    def to_execution_plan(self, metadata, mask, final, executor=None, workspace=None):
         """
-            to execute pipe logic
+            to execute pipe logic ; outputs of terms are looked up from workspace
+            (computed by engine for all pipelines) when it is given
         """
-        term_graph = self._init_graph()
-        self._decref_dependence(term_graph, metadata, mask)
+        if workspace is None:
+            self._decref_dependence(self.plan, metadata, mask, executor)
+        else:
+            self._workspace = OrderedDict((term, workspace[term]) for term in self.plan.terms)
         result = self.compute_eager_pipeline(final)
         self._workspace = OrderedDict()
+        self._scores = dict()
         return result
 
-    def to_withdraw_plan(self, position, metadata):
+    def to_withdraw_plan(self, position, metadata, scores=None):
+        """
+            to execute ump_picker logic , scores --- term : dict sid : score shared by pipelines
+        """
+        out = self._ump.evaluate(position, metadata, scores)
+        return out
+
+    def to_withdraw_batch(self, positions, metadata, scores=None, panel=None):
         """
-            to execute ump_picker logic
+            ump_picker logic for all positions of pipe in one call , panel --- SignalPanel of metadata
         """
-        out = self._ump.evaluate(position, metadata)
+        out = self._ump.evaluate_batch(positions, metadata, scores, panel)
         return out
 
 
@@ -5,7 +5,7 @@ Created on Tue Mar 12 15:37:47 2019
 
 @author: python
 """
-import glob, os
+import glob, os, threading, hashlib, numpy as np, pandas as pd
 from toolz import valmap
 from weakref import WeakValueDictionary
 from pipe.domain import infer_domain
@@ -17,6 +17,146 @@ class NotSpecific(Exception):
         return 'object not specific'
 
 
+class StrategyRegistry(object):
+    """
+        compiled strategy modules under base_dir keyed by file mtime
+
+        the strategy file is read and compiled once , the class object is reused by every
+        term of the same script until the file is modified --- term construction during a
+        params sweep only initializes the signal
+    """
+    def __init__(self, base_dir):
+        self.base_dir = base_dir
+        self._paths = dict()
+        self._modules = dict()
+        self._digests = dict()
+        self._lock = threading.Lock()
+
+    def _locate(self, script):
+        # path of script is globbed once , later resolves only stat the file
+        try:
+            return self._paths[script]
+        except KeyError:
+            pass
+        files = glob.glob(os.path.join(self.base_dir, '%s.py' % script))
+        if not files:
+            raise ImportError('strategy %s is not found in %s' % (script, self.base_dir))
+        self._paths[script] = files[0]
+        return files[0]
+
+    def _stat(self, script):
+        """
+            (file , mtime) of script , located again when the file is moved or removed
+        """
+        file = self._locate(script)
+        try:
+            return file, os.stat(file).st_mtime
+        except OSError:
+            self._paths.pop(script, None)
+            file = self._locate(script)
+            return file, os.stat(file).st_mtime
+
+    def _file_digest(self, file, mtime):
+        # md5 of file , hashed once per mtime and shared by digest and source_digest
+        try:
+            cached_mtime, digest = self._digests[file]
+        except KeyError:
+            cached_mtime, digest = None, None
+        if cached_mtime != mtime:
+            with open(file, 'rb') as f:
+                digest = hashlib.md5(f.read()).hexdigest()
+            self._digests[file] = (mtime, digest)
+        return digest
+
+    def _compile(self, file, script):
+        with open(file, 'r') as f:
+            code = compile(f.read(), file, 'exec')
+        namespace = {'__name__': 'strat.%s' % script, '__file__': file}
+        exec(code, namespace)
+        return namespace
+
+    def resolve(self, script):
+        """
+            class object (capitalized script name) of the strategy file
+        """
+        file, mtime = self._stat(script)
+        with self._lock:
+            try:
+                cached_mtime, namespace = self._modules[file]
+            except KeyError:
+                cached_mtime, namespace = None, None
+            if cached_mtime != mtime:
+                namespace = self._compile(file, script)
+                self._modules[file] = (mtime, namespace)
+        return namespace[script.capitalize()]
+
+    def digest(self, script):
+        """
+            md5 of the strategy file , part of Term.fingerprint
+        """
+        file, mtime = self._stat(script)
+        return self._file_digest(file, mtime)
+
+    def source_digest(self):
+        """
+            md5 of every strategy file under base_dir , changes when any strat (or its helper) is edited ;
+            files are only hashed again when their mtime changes
+        """
+        md5 = hashlib.md5()
+        for file in sorted(glob.glob(os.path.join(self.base_dir, '*.py'))):
+            md5.update(self._file_digest(file, os.stat(file).st_mtime).encode('utf-8'))
+        return md5.hexdigest()
+
+    def clear(self):
+        with self._lock:
+            self._paths.clear()
+            self._modules.clear()
+            self._digests.clear()
+
+
+class SignalPanel(object):
+    """
+        metadata (sid : window frame) as field : (window × sids) arrays
+
+        rows are aligned to the end of window --- the last row of every sid is the last row
+        of array and the head of short windows is filled with nan , so rolling logic on the
+        columns is the same as the logic on each frame
+    """
+    def __init__(self, metadata):
+        self.sids = pd.Index(list(metadata))
+        frames = list(metadata.values())
+        self.window = max([len(frame) for frame in frames]) if frames else 0
+        # union of numeric columns over frames , frames of reader share columns and dtypes so
+        # the numeric columns are resolved once per layout ; field missing in a frame is nan
+        numerics, fields, layouts = dict(), [], []
+        for frame in frames:
+            layout = (tuple(frame.columns), tuple(frame.dtypes))
+            if layout not in numerics:
+                numerics[layout] = set(frame.select_dtypes('number').columns)
+                fields.extend([field for field in frame.columns if field in numerics[layout] and field not in fields])
+            layouts.append(layout)
+        self._arrays = dict()
+        for field in fields:
+            array = np.full((self.window, len(frames)), np.nan)
+            for col, frame in enumerate(frames):
+                if len(frame) and field in numerics[layouts[col]]:
+                    array[-len(frame):, col] = frame[field].values
+            self._arrays[field] = array
+
+    def take(self, sids):
+        """
+            field : (window × sids) arrays , sid which is not in metadata is nan
+        """
+        cols = self.sids.get_indexer(sids)
+        missing = cols < 0
+        panel = dict()
+        for field, array in self._arrays.items():
+            block = array[:, cols]
+            block[:, missing] = np.nan
+            panel[field] = block
+        return panel
+
+
 class Term(object):
     """
         term.specialize(domain)
@@ -39,10 +179,8 @@ class Term(object):
     """
     default_type = (tuple,)
     _term_cache = WeakValueDictionary()
-    namespace = dict()
-    # base_dir = os.path.join(os.path.split(os.getcwd())[0], 'strat')
-    base_dir = '/Users/python/Library/Mobile Documents/com~apple~CloudDocs/ArkQuant/strat'
-    # base_dir = os.path.join(os.path.split(os.path.abspath('__file__'))[0], 'strat')
+    base_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'strat')
+    registry = StrategyRegistry(base_dir)
 
     def __new__(cls,
                 script,
@@ -83,13 +221,10 @@ class Term(object):
             don't want to call __init__ again.
         """
         params = dict(p)
-        # 解析信号文件并获取类对象
-        # print('base_dir', self.base_dir)
-        file = glob.glob(os.path.join(self.base_dir, '%s.py' % script))[0]
-        # print(file)
-        with open(file, 'r') as f:
-            exec(f.read(), self.namespace)
-        logic = self.namespace[script.capitalize()]
+        self.script = script
+        self._fingerprint = None
+        # 解析信号文件并获取类对象 (compiled once until the file is modified)
+        logic = self.registry.resolve(script)
         try:
             self.signal = logic(params)
             self._validate()
@@ -132,7 +267,7 @@ class Term(object):
                 raise TypeError('cannot transform the style of data to %r due to error %s' % (self.default_type, e))
         return data
 
-    def _compute(self, meta, mask):
+    def _compute(self, meta, mask, scores=None):
         """
             Subclasses should implement this to perform actual computation.
             This is named ``_compute`` rather than just ``compute`` because
@@ -141,23 +276,68 @@ class Term(object):
             1. subclass should implement when _verify_asset_finder is True
             2. self.postprocess()
         """
-        output = self.signal.long_signal(meta, mask)
+        output = self.signal.long_signal(meta, mask, scores)
         validate_output = self.postprocess(output)
         return validate_output
 
-    def compute(self, metadata, mask):
+    def compute(self, metadata, mask, scores=None):
         """
             1. subclass should implement when _verify_asset_finder is True
             2. self.postprocess()
+            scores --- dict , optional , filled with sid : score of mask
         """
-        output = self._compute(metadata, mask)
+        output = self._compute(metadata, mask, scores)
         # print('term output', output)
         return output
 
+    @property
+    def vectorized(self):
+        return self.signal.vectorized
+
+    @property
+    def warmup(self):
+        """
+            bars of each field in domain needed by the term
+        """
+        return self.signal.warmup or self.domain.domain_window
+
+    def compute_panel(self, panel, mask, scores=None):
+        """
+            cross sectional path of compute , panel --- SignalPanel of metadata
+        """
+        output = self.signal.long_signal_panel(panel.take([m.sid for m in mask]), mask, scores)
+        validate_output = self.postprocess(output)
+        return validate_output
+
+    @property
+    def fingerprint(self):
+        """
+            stable digest of script source , params and dependencies across processes
+            (term identity of _term_cache only holds in one process)
+        """
+        if self._fingerprint is None:
+            deps = [dep.fingerprint if isinstance(dep, Term) else repr(dep) for dep in self.dependencies]
+            params = sorted(self.signal.params.items())
+            identity = repr((self.script, self.registry.digest(self.script), params, deps))
+            self._fingerprint = hashlib.md5(identity.encode('utf-8')).hexdigest()
+        return self._fingerprint
+
     def withdraw(self, feed):
         signal = self.signal.short_signal(feed)
         return signal
 
+    def withdraw_score(self, score):
+        # vote on the score shared by pipelines
+        signal = self.signal.short_signal_score(score)
+        return signal
+
+    def withdraw_panel(self, panel, sids):
+        """
+            cross sectional path of withdraw , bool vote per sid on SignalPanel of metadata
+        """
+        signal = self.signal.short_signal_panel(panel.take(sids))
+        return signal
+
     def __repr__(self):
         return (
             "{type}({args})"
@@ -182,3 +362,9 @@ class Term(object):
 #     break_term = Term('break', kw, cross_term)
 #     print(break_term.dependencies)
 
+#
+#     import time
+#     start = time.time()
+#     for fast in range(1000):
+#         Term('break', {'window': 10, 'fast': fast, 'slow': 26, 'period': 9})
+#     print('1000 terms of params sweep', time.time() - start)
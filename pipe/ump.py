@@ -6,7 +6,7 @@ Created on Tue Mar 12 15:37:47 2019
 @author: python
 """
 import numpy as np
-from pipe.term import Term
+from pipe.term import Term, SignalPanel
 
 
 class UmpPickers(object):
@@ -33,18 +33,62 @@ class UmpPickers(object):
     def pickers(self):
         return self._poll_pickers
 
-    def _evaluate_for_position(self, position, metadata):
-        # withdraw --- return bool
-        votes = [picker.withdraw(metadata[position.asset.sid])
-                 for picker in self.pickers]
+    def _evaluate_for_position(self, position, metadata, scores):
+        # withdraw --- return bool ; picker which is a pipeline term votes on its shared score
+        sid = position.asset.sid
+        votes = [picker.withdraw_score(scores[picker][sid]) if sid in scores.get(picker, {})
+                 else picker.withdraw(metadata[sid]) for picker in self.pickers]
         if np.all(votes):
             return position
         return False
 
-    def evaluate(self, position, metadata):
-        vote = self._evaluate_for_position(position, metadata)
+    def evaluate(self, position, metadata, scores=None):
+        """
+            scores --- term : dict sid : score , computed by pipelines of the session
+        """
+        vote = self._evaluate_for_position(position, metadata, scores or dict())
         return vote
 
+    def _vote_picker(self, picker, sids, metadata, scores, panel):
+        """
+            votes of picker on sids --- shared score first , then SignalPanel for vectorized
+            picker or feed of each sid ; sid without data is kept (False)
+        """
+        votes = np.zeros(len(sids), dtype=bool)
+        known = scores.get(picker, {})
+        shared = np.array([sid in known for sid in sids], dtype=bool)
+        if shared.any():
+            values = np.array([known[sid] for sid in np.asarray(sids)[shared]], dtype=np.float64)
+            votes[shared] = picker.withdraw_score(values)
+        rest = np.array([not hit and sid in metadata for hit, sid in zip(shared, sids)], dtype=bool)
+        if rest.any():
+            rest_sids = list(np.asarray(sids)[rest])
+            if picker.vectorized:
+                votes[rest] = picker.withdraw_panel(panel, rest_sids)
+            else:
+                votes[rest] = [bool(picker.withdraw(metadata[sid])) for sid in rest_sids]
+        return votes
+
+    def evaluate_batch(self, positions, metadata, scores=None, panel=None):
+        """
+            (positions × pickers) bool matrix , position is withdrawn when all pickers vote ;
+            panel --- SignalPanel of metadata for vectorized pickers , built once here when not given
+
+        Returns
+        -------
+        withdraw : list of position
+        """
+        positions = list(positions)
+        if not positions:
+            return []
+        sids = [position.asset.sid for position in positions]
+        if panel is None and any(picker.vectorized for picker in self.pickers):
+            panel = SignalPanel(metadata)
+        votes = np.column_stack([self._vote_picker(picker, sids, metadata, scores or dict(), panel)
+                                 for picker in self.pickers])
+        withdraw = np.all(votes, axis=1)
+        return [position for position, vote in zip(positions, withdraw) if vote]
+
 
 __all__ = ['UmpPickers']
 
@@ -5,6 +5,7 @@ Created on Sat Feb 16 14:00:14 2019
 
 @author: python
 """
+import numpy as np
 from abc import ABC, abstractmethod
 from toolz import valfilter
 
@@ -21,19 +22,39 @@ class Signal(ABC):
         # final term --- return sorted assets including priority
         return self.params.get('final', False)
 
+    @property
+    def warmup(self):
+        # bars needed by _run_signal , None means the window of domain (max int param)
+        return None
+
+    @property
+    def vectorized(self):
+        # strat implements _run_signal_panel
+        return type(self)._run_signal_panel is not Signal._run_signal_panel
+
     @abstractmethod
     def _run_signal(self, feed):
         raise NotImplementedError('implement logic of strat')
 
-    def long_signal(self, metadata, mask) -> bool:
+    def _run_signal_panel(self, panel):
         """
-        intended for pipeline
-        :param mask:  bool
-        :param metadata:  metadata which computed by get_loader
-        :return: assets
+            optional cross sectional logic of strat
+        :param panel: dict field : (window × sids) array , rows aligned to the end of window
+        :return: np.ndarray of scores , one per sid (nan means no signal)
         """
-        signals = [self._run_signal(metadata[m.sid]) for m in mask]
-        # print('signals', signals)
+        raise NotImplementedError('cross sectional logic of strat')
+
+    def _panel_feed(self, panel):
+        # panel of the only field , same as feed of _run_signal ; close when params has no fields
+        if len(panel) == 1:
+            return next(iter(panel.values()))
+        fields = self.params.get('fields') or ['close']
+        return panel[fields[0]]
+
+    def _select(self, mask, signals, scores=None):
+        if scores is not None:
+            # sid : score , shared with ump (short_signal_score)
+            scores.update(zip([m.sid for m in mask], signals))
         zp = valfilter(lambda x: x > self.params.get('threshold', 0), dict(zip(mask, signals)))
         # print('signal mapping', zp)
         if self.final:
@@ -45,14 +66,59 @@ class Signal(ABC):
             # print('ordinary out', out)
         return out
 
+    def long_signal(self, metadata, mask, scores=None) -> bool:
+        """
+        intended for pipeline
+        :param mask:  bool
+        :param metadata:  metadata which computed by get_loader
+        :param scores: dict , optional , filled with sid : score of mask
+        :return: assets
+        """
+        signals = [self._run_signal(metadata[m.sid]) for m in mask]
+        # print('signals', signals)
+        return self._select(mask, signals, scores)
+
+    def long_signal_panel(self, panel, mask, scores=None) -> bool:
+        """
+        intended for pipeline , one call of _run_signal_panel for all assets of mask
+        :param panel: dict field : (window × assets of mask) array
+        :param mask: assets
+        :param scores: dict , optional , filled with sid : score of mask
+        :return: assets
+        """
+        signals = self._run_signal_panel(panel)
+        return self._select(mask, list(signals), scores)
+
+    def _withdraw(self, val) -> bool:
+        # score of _run_signal --- vote of ump
+        return val
+
     def short_signal(self, metadata) -> bool:
         """
         intended for ump
         :param metadata: metadata which computed by get_loader
         :return: bool
         """
-        val = self._run_signal(metadata)
+        val = self._withdraw(self._run_signal(metadata))
         return val
 
+    def short_signal_score(self, score) -> bool:
+        """
+        intended for ump , score computed by long_signal of the same session
+        :param score: float
+        :return: bool
+        """
+        val = self._withdraw(score)
+        return val
+
+    def short_signal_panel(self, panel):
+        """
+        intended for ump , one call of _run_signal_panel for all positions
+        :param panel: dict field : (window × sids) array
+        :return: np.ndarray of bool , one vote per sid
+        """
+        val = self._withdraw(np.asarray(self._run_signal_panel(panel), dtype=np.float64))
+        return np.asarray(val, dtype=bool)
+
 
 __all__ = ['Signal']
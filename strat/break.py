@@ -20,6 +20,10 @@ class Break(Signal):
         self.ema = EMA()
         self.ma = MA()
 
+    @property
+    def warmup(self):
+        return self.params['window']
+
     def _run_signal(self, feed):
         # default -- buy operation
         ema = self.ema.compute(feed, self.params)
@@ -29,11 +33,18 @@ class Break(Signal):
         deviation = ema[-1] - ma.iloc[-1]
         return deviation
 
-    def long_signal(self, data, mask) -> bool:
-        out = super().long_signal(data, mask)
+    def _run_signal_panel(self, panel):
+        feed = self._panel_feed(panel)
+        ema = self.ema.latest(feed, self.params)
+        ma = self.ma.latest(feed, self.params)
+        deviation = ema - ma
+        return deviation
+
+    def long_signal(self, data, mask, scores=None) -> bool:
+        out = super().long_signal(data, mask, scores)
         # print('break out', out)
         return out
 
-    def short_signal(self, feed) -> bool:
-        value = super().short_signal(feed) < 0
+    def _withdraw(self, val) -> bool:
+        value = val < 0
         return value
@@ -17,6 +17,10 @@ class Cross(Signal):
         super(Cross, self).__init__(params)
         self.ma = MA()
 
+    @property
+    def warmup(self):
+        return max(self.params['window'])
+
     def _run_signal(self, feed):
         # default -- buy operation
         long = self.ma.compute(feed, {'window': max(self.params['window'])})
@@ -26,11 +30,18 @@ class Cross(Signal):
         deviation = short.iloc[-1] - long.iloc[-1]
         return deviation
 
-    def long_signal(self, data, mask) -> bool:
-        out = super().long_signal(data, mask)
+    def _run_signal_panel(self, panel):
+        feed = self._panel_feed(panel)
+        long = self.ma.latest(feed, {'window': max(self.params['window'])})
+        short = self.ma.latest(feed, {'window': min(self.params['window'])})
+        deviation = short - long
+        return deviation
+
+    def long_signal(self, data, mask, scores=None) -> bool:
+        out = super().long_signal(data, mask, scores)
         # print('cross signal', out)
         return out
 
-    def short_signal(self, feed) -> bool:
-        signal = super().short_signal(feed) < 0
+    def _withdraw(self, val) -> bool:
+        signal = val < 0
         return signal
@@ -8,6 +8,8 @@ Created on Tue Mar 12 15:37:47 2019
 import pandas as pd
 from contextlib import ExitStack
 from util.api_support import AlgoAPI
+from gateway.asset.finder import asset_finder
+from gateway.driver.data_portal import portal
 from trade import (
     SESSION_START,
     SESSION_END,
@@ -51,6 +53,11 @@ class AlgorithmSimulator(object):
         broker = self.algorithm.broker
         metrics_tracker = self.algorithm.tracker
 
+        def before_trading_start(dts):
+            dts = dts.strftime('%Y-%m-%d') if isinstance(dts, pd.Timestamp) else dts
+            # price limits of the alive universe are read once and shared by execution , division and blotter
+            portal.prime_price_limits(asset_finder.lifetimes([dts, dts]), dts)
+
         def once_a_day(dts):
             dts = dts.strftime('%Y-%m-%d') if isinstance(dts, pd.Timestamp) else dts
             broker.implement_broke(ledger, dts)
@@ -77,6 +84,7 @@ class AlgorithmSimulator(object):
             for session_label, action in self.clock:
                 print('session_label and action :', session_label, action)
                 if action == BEFORE_TRADING_START:
+                    before_trading_start(session_label)
                     metrics_tracker.handle_market_open(session_label, ledger)
                 elif action == SESSION_START:
                     once_a_day(session_label)
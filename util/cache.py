@@ -9,7 +9,7 @@ from functools import partial
 from distutils import dir_util
 from shutil import rmtree, move
 from tempfile import mkdtemp, NamedTemporaryFile
-import os, pickle, errno, pandas as pd
+import os, pickle, errno, hashlib, pandas as pd
 from util.paths import ensure_directory
 
 
@@ -127,6 +127,74 @@ class ExpiredCache(object):
         del self._cache[key]
 
 
+class ResultMemo(object):
+    """
+    On-disk memo of session results , files are written as
+    ``path/<session>/<name>_<digest>.pkl``.
+
+    The digest covers the key parts given by caller and the data version , so the
+    entries written before bar store or adjustment data changes are never read again.
+
+    Parameters
+    ----------
+    path : str
+        The directory of memo.
+    version : callable
+        Returns the current data version (str) , e.g. DataPortal.data_version ;
+        evaluated once per session (get and set of one session share it).
+    """
+    def __init__(self, path, version):
+        self.path = path
+        self._version = version
+        # (session , data version) --- version is computed once per session
+        self._session_version = (None, None)
+        ensure_directory(self.path)
+
+    def _data_version(self, session):
+        cached, version = self._session_version
+        if cached != session:
+            version = self._version()
+            self._session_version = (session, version)
+        return version
+
+    def _keypath(self, name, session, parts):
+        identity = repr((parts, self._data_version(session)))
+        digest = hashlib.md5(identity.encode('utf-8')).hexdigest()
+        return os.path.join(self.path, session, '%s_%s.pkl' % (name, digest))
+
+    def get(self, name, session, parts):
+        """
+        Raises
+        ------
+        KeyError
+            Raised if result is not memoized under the current data version.
+        """
+        try:
+            with open(self._keypath(name, session, parts), 'rb') as f:
+                return pickle.load(f)
+        except IOError as e:
+            if e.errno != errno.ENOENT:
+                raise
+            raise KeyError((name, session))
+
+    def set(self, name, session, parts, value):
+        path = self._keypath(name, session, parts)
+        ensure_directory(os.path.dirname(path))
+        # write aside and replace , reader never sees a partial file
+        with NamedTemporaryFile('wb', dir=os.path.dirname(path), delete=False) as f:
+            try:
+                pickle.dump(value, f)
+            except Exception:
+                f.close()
+                os.unlink(f.name)
+                raise
+        os.replace(f.name, path)
+
+    def clear(self):
+        rmtree(self.path)
+        ensure_directory(self.path)
+
+
 class DummyMapping(object):
     """
     Dummy object used to provide a mapping interface for singular values.